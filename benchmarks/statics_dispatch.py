@@ -0,0 +1,81 @@
+"""Compares PluggedStaticsMiddleware dispatching against the previous
+implementation that split PATH_INFO on every request.
+
+Run from an environment where tgext.pluggable is installed::
+
+    $ python benchmarks/statics_dispatch.py
+"""
+from __future__ import print_function
+import timeit
+
+from tgext.pluggable.adapt_statics import PluggedStaticsMiddleware
+from tgext.pluggable.plug import SharedPluggedDict
+
+PLUGGABLES = 20
+NUMBER = 200000
+
+
+class SplittingStaticsMiddleware(object):
+    """The dispatching code that predates the routing table."""
+    def __init__(self, app, plugged):
+        self.plugged = plugged
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        path_info = environ.get('PATH_INFO', '')
+
+        if not path_info.startswith('/_pluggable/'):
+            return self.app(environ, start_response)
+
+        root_path = path_info.split('/')
+        while not root_path[0]:
+            root_path.pop(0)
+        root_path = root_path[1]
+
+        module_config = self.plugged['modules'].get(root_path)
+        if module_config:
+            environ['PATH_INFO'] = path_info[len('/_pluggable/'+root_path):]
+            return module_config['statics'](environ, start_response)
+        else:
+            return self.app(environ, start_response)
+
+
+def noop_app(environ, start_response):
+    return environ['PATH_INFO']
+
+
+def make_plugged():
+    plugged = SharedPluggedDict()
+    for idx in range(PLUGGABLES):
+        module_name = 'pluggable%d' % idx
+        plugged['modules'][module_name] = dict(appid=module_name, module_name=module_name,
+                                               module=None, statics=noop_app)
+        plugged['statics_revision'] += 1
+    return plugged
+
+
+def run(label, middleware, path):
+    environ = {'PATH_INFO': path}
+
+    def dispatch():
+        environ['PATH_INFO'] = path
+        middleware(environ, None)
+
+    best = min(timeit.repeat(dispatch, number=NUMBER, repeat=5))
+    print('%-12s %-60s %.3f usec/request' % (label, path, best / NUMBER * 1e6))
+
+
+def main():
+    plugged = make_plugged()
+    paths = ('/_pluggable/pluggable%d/css/style.css' % (PLUGGABLES - 1),
+             '/_pluggable/pluggable0/images/deeply/nested/path/star.png',
+             '/_pluggable/unknown/css/style.css',
+             '/index.html')
+
+    for path in paths:
+        run('splitting', SplittingStaticsMiddleware(noop_app, plugged), path)
+        run('table', PluggedStaticsMiddleware(noop_app, plugged), path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Compares applying template patches with PatchesMatcher, with and
+without cached fragments, against running the selector of each
+action over the whole document.
+
+Contents of the actions are rendered through a Kajiki template,
+like the action templates of the application would be, which is
+the work cached fragments avoid.
+
+Run from an environment where tgext.pluggable and lxml are installed::
+
+    $ python benchmarks/template_patching.py
+"""
+from __future__ import print_function
+import timeit
+
+from kajiki import XMLTemplate
+
+from tgext.pluggable import template_patching
+from tgext.pluggable.template_patching import Action, PatchesMatcher
+
+template_patching._import_etree()
+from lxml import html
+
+PAGES_ROWS = (20, 500)
+NUMBER = 20
+
+SELECTORS = [
+    ('append', '#menu ul.nav'),
+    ('prepend', '#menu ul.nav > li.first'),
+    ('content', '#sidebar h3'),
+    ('append', 'head'),
+    ('append', 'body > div#footer'),
+    ('replace', '.ads'),
+    ('replace', 'div.banner'),
+    ('append', 'table.report thead tr'),
+    ('prepend', 'table.report'),
+    ('append', 'table.report'),
+    ('content', '#title'),
+    ('append', '#user-menu li.logout'),
+    ('prepend', '#user-menu li.profile'),
+    ('replace', 'a.legacy-link'),
+    ('append', 'form#search'),
+    ('content', 'form#search button'),
+    ('append', '#sidebar ul.links'),
+    ('prepend', '#sidebar ul.links > li'),
+    ('replace', 'script[data-legacy]'),
+    ('append', 'div.pagination'),
+    ('prepend', 'div.pagination'),
+    ('content', 'span.total'),
+    ('append', '#breadcrumb ol'),
+    ('replace', 'p.notice.dismissed'),
+    ('append', 'div#content > h1'),
+    ('prepend', 'div#content > h1'),
+    ('content', 'footer .copyright'),
+    ('append', 'ul.tabs li.active'),
+    ('replace', 'td.hidden-column'),
+    ('append', 'meta[name=viewport]'),
+    ('content', 'div.help-text'),
+    ('append', 'li.extra-entry'),
+]
+
+
+def make_page(rows_count):
+    rows = ''.join('<tr class="row"><td class="id">%d</td><td class="name">Row %d</td>'
+                   '<td class="hidden-column">x</td><td><a class="edit" href="/edit/%d">edit</a></td></tr>'
+                   % (i, i, i) for i in range(rows_count))
+    links = ''.join('<li><a href="/link/%d">Link %d</a></li>' % (i, i) for i in range(30))
+    return ('<!DOCTYPE html><html><head><title>Report</title><meta name="viewport" content="width=device-width"/>'
+            '<script data-legacy="1" src="/old.js"></script></head><body>'
+            '<div id="menu"><ul class="nav"><li class="first"><a href="/">Home</a></li>%s</ul></div>'
+            '<ul id="user-menu"><li class="profile">Profile</li><li class="logout">Logout</li></ul>'
+            '<ol id="breadcrumb"><li>Home</li><li>Reports</li></ol>'
+            '<div class="banner">Banner</div><div class="ads">Ads</div>'
+            '<div id="sidebar"><h3>Links</h3><ul class="links">%s</ul><div class="help-text">Help</div></div>'
+            '<div id="content"><h1 id="title">Report</h1><form id="search"><input name="q"/><button>Go</button></form>'
+            '<ul class="tabs"><li class="active">All</li><li>Mine</li></ul>'
+            '<p class="notice dismissed">Notice</p><a class="legacy-link" href="/old">Old</a>'
+            '<table class="report"><thead><tr><th>Id</th><th>Name</th></tr></thead><tbody>%s</tbody></table>'
+            '<div class="pagination"><span class="total">%d</span></div></div>'
+            '<div id="footer"><footer><span class="copyright">(c)</span></footer></div>'
+            '</body></html>') % (links, links, rows, rows_count)
+
+
+FRAGMENT = XMLTemplate(u'''<li xmlns:py="http://genshi.edgewall.org/" class="extra-entry">
+  <a py:for="i in range(5)" href="/entry/${i}" title="${label} ${i}">${label.upper()} ${i}</a>
+</li>''', mode='html5')
+
+
+def render_content(action):
+    if action.name == 'replace':
+        return ''
+    return FRAGMENT(dict(label=action.selector.css)).render()
+
+
+def apply_each_selector(root, actions):
+    """The patching code that predates PatchesMatcher."""
+    for action in actions:
+        nodes = action.selector(root)
+        if nodes:
+            content = render_content(action)
+        for node in nodes:
+            action.apply(node, content)
+
+
+def benchmark(page):
+    actions = [Action(name, selector, None) for name, selector in SELECTORS]
+    matcher = PatchesMatcher(actions)
+    cached_actions = [Action(name, selector, None, 'static') for name, selector in SELECTORS]
+    cached_matcher = PatchesMatcher(cached_actions)
+
+    def each_selector():
+        root = html.document_fromstring(page)
+        apply_each_selector(root, actions)
+        return html.tostring(root)
+
+    def single_pass():
+        root = html.document_fromstring(page)
+        matcher.apply(root, lambda action: action.fragment({}, lambda: render_content(action)))
+        return html.tostring(root)
+
+    def cached_fragments():
+        root = html.document_fromstring(page)
+        cached_matcher.apply(root, lambda action: action.fragment({}, lambda: render_content(action)))
+        return html.tostring(root)
+
+    assert each_selector() == single_pass() == cached_fragments()
+
+    print('%d actions on a page of %d bytes' % (len(actions), len(page)))
+    for label, func in (('each selector', each_selector), ('single pass', single_pass),
+                        ('cached', cached_fragments)):
+        best = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        print('%-14s %.3f msec/response' % (label, best / NUMBER * 1e3))
+
+
+def main():
+    # Rendering the contents weights more on smaller pages
+    for rows_count in PAGES_ROWS:
+        benchmark(make_page(rows_count))
+
+
+if __name__ == '__main__':
+    main()
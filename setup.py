@@ -38,6 +38,9 @@ setup(name='tgext.pluggable',
               'quickstart-pluggable = tgext.pluggable.commands.quickstart:QuickstartPluggableCommand',
               'sqla-migrate-pluggable = tgext.pluggable.commands.migration:MigrateCommand',
               'migrate-pluggable = tgext.pluggable.commands.alembic_migration:MigrateCommand',
-              'plug = tgext.pluggable.commands.plug:PlugApplicationCommand'
+              'plug = tgext.pluggable.commands.plug:PlugApplicationCommand',
+              'precompress-pluggable-statics = tgext.pluggable.commands.precompress:PrecompressStaticsCommand',
+              'collect-pluggable-statics = tgext.pluggable.commands.collect:CollectStaticsCommand',
+              'pluggable-startup-report = tgext.pluggable.commands.startup_report:StartupReportCommand'
           ]
       })
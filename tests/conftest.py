@@ -0,0 +1,64 @@
+import os
+import sys
+import types
+
+import pytest
+import tg
+from tg import MinimalApplicationConfigurator
+from tg.configuration import milestones
+from tg.configurator.components.i18n import I18NConfigurationComponent
+from webtest import TestApp
+
+from tgext.pluggable import plug
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'fixtures'))
+
+
+def make_app(root_controller=None, plug_options=None, setup=None, i18n=False, **options):
+    """Application with ``root_controller`` plugging the ``plugtest`` pluggable.
+
+    Pluggables are mounted on ``hostapp.controllers.root.RootController``,
+    which is used when no ``root_controller`` is provided.
+
+    ``setup`` is called with the configurator before the application is created,
+    ``plug_options`` are passed to ``plug`` or ``None`` disables plugging.
+    ``i18n`` enables translations of the application.
+    """
+    if milestones.renderers_ready.reached:
+        # Actions registered for the renderers of a previous application
+        # have all been performed, let the new one reach it again.
+        milestones.renderers_ready._reset()
+
+    helpers = types.ModuleType('helpers')
+    configurator = MinimalApplicationConfigurator()
+    configurator.update_blueprint({
+        'renderers': ['kajiki', 'json'],
+        'default_renderer': 'kajiki',
+        'helpers': helpers,
+        'package': __import__('hostapp'),
+        'root_controller': root_controller,
+    })
+    if i18n:
+        configurator.register(I18NConfigurationComponent)
+        configurator.update_blueprint({'i18n.enabled': True})
+    if plug_options is not None:
+        plug(configurator, 'plugtest', **plug_options)
+    if setup is not None:
+        setup(configurator)
+    return TestApp(configurator.make_wsgi_app(options, {}))
+
+
+@pytest.fixture
+def partials_calls():
+    from plugtest import partials
+    del partials.CALLS[:]
+    return partials.CALLS
+
+
+@pytest.fixture(autouse=True)
+def application_hooks():
+    """Application wide hooks registered by a test are removed once it completes"""
+    registered = dict((name, list(hooks)) for name, hooks in tg.hooks._hooks.items())
+    yield
+    tg.hooks._hooks.clear()
+    tg.hooks._hooks.update(registered)
@@ -0,0 +1,7 @@
+from tg import expose, TGController
+
+
+class RootController(TGController):
+    @expose()
+    def index(self):
+        return 'hostapp'
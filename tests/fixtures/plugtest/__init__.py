@@ -0,0 +1,2 @@
+def plugme(app_config, options):
+    return dict(appid='plugtest', global_helpers=False)
@@ -0,0 +1,14 @@
+from tg import expose, TGController
+class RootController(TGController):
+    @expose()
+    def index(self):
+        return 'plugtest root'
+
+    @expose('kajiki:plugtest.templates.little')
+    def little(self):
+        return dict(name='little')
+
+    @expose('kajiki:plugtest.templates.little')
+    @expose('json')
+    def both(self):
+        return dict(name='both')
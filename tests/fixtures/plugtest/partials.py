@@ -0,0 +1,63 @@
+import threading
+
+import tg
+from tg import expose, TGController
+from tgext.pluggable import cached_partial
+
+CALLS = []
+RELEASE_SLOW = threading.Event()
+
+@expose('kajiki:plugtest.templates.little')
+def something(name):
+    CALLS.append(name)
+    return dict(name=name)
+
+@cached_partial(expire=60)
+@expose('kajiki:plugtest.templates.little')
+def cached(name):
+    CALLS.append('cached-' + name)
+    return dict(name=name)
+
+@cached_partial()
+@expose()
+def greeting():
+    from tg.i18n import ugettext as _
+    CALLS.append('greeting')
+    return _('hello')
+
+class Widgets(TGController):
+    def __init__(self):
+        CALLS.append('widgets')
+        super(Widgets, self).__init__()
+
+    @expose('kajiki:plugtest.templates.little')
+    def box(self, name='box'):
+        return dict(name=name)
+
+@expose()
+def nested(name):
+    from tgext.pluggable import call_partials
+    return '[' + ''.join(call_partials([('plugtest.partials:something', {'name': name + str(i)}) for i in range(3)])) + ']'
+
+@cached_partial(depends_on=['articles'])
+@expose()
+def articles():
+    CALLS.append('articles')
+    return 'articles'
+
+
+@expose()
+def slow():
+    RELEASE_SLOW.wait(5)
+    try:
+        tg.request.path
+    except AttributeError:
+        CALLS.append('slow-detached')
+        raise
+    CALLS.append('slow')
+    return 'slow'
+
+@expose()
+def context_value():
+    tg.tmpl_context.value = 'partial'
+    return tg.request.path
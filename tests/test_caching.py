@@ -0,0 +1,112 @@
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from tg import expose, TGController
+
+from tgext.pluggable import call_partial, caching
+from conftest import make_app
+
+
+class RootController(TGController):
+    @expose()
+    def cached(self, name):
+        return call_partial('plugtest.partials:cached', name=name)
+
+    @expose()
+    def greeting(self):
+        return call_partial('plugtest.partials:greeting')
+
+
+def test_cached_partial(partials_calls):
+    app = make_app(RootController(), plug_options={})
+    assert 'Hello a' in app.get('/cached', params={'name': 'a'}).text
+    assert 'Hello a' in app.get('/cached', params={'name': 'a'}).text
+    assert 'Hello b' in app.get('/cached', params={'name': 'b'}).text
+    assert partials_calls == ['cached-a', 'cached-b']
+
+
+def test_cached_partial_expiration_and_eviction(partials_calls, monkeypatch):
+    app = make_app(RootController(), plug_options={}, **{'tgext.pluggable.partials_cache_size': 2})
+    for name in ('a', 'b', 'a', 'c', 'a', 'b'):
+        app.get('/cached', params={'name': name})
+    # b was the least recently used when c got cached
+    assert partials_calls == ['cached-a', 'cached-b', 'cached-c', 'cached-b']
+
+    cache = caching.partials_cache()
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert cache.stats['plugtest.partials:cached'] == [2, 4]
+
+    now = time.time()
+    monkeypatch.setattr(caching.time, 'time', lambda: now + 61)
+    app.get('/cached', params={'name': 'a'})
+    assert partials_calls[-1] == 'cached-a'
+
+
+def test_cached_partial_per_language(partials_calls):
+    app = make_app(RootController(), plug_options={}, i18n=True)
+    assert app.get('/greeting', headers={'Accept-Language': 'it'}).text == 'ciao host'
+    assert app.get('/greeting', headers={'Accept-Language': 'en'}).text == 'hello'
+    assert app.get('/greeting', headers={'Accept-Language': 'it'}).text == 'ciao host'
+    assert partials_calls == ['greeting', 'greeting']
+
+
+def test_partials_cache_created_once(monkeypatch):
+    created = []
+    def slow_backend(config):
+        time.sleep(0.05)
+        created.append(1)
+        return caching.MemoryCacheBackend()
+    monkeypatch.setattr(caching, '_create_backend', slow_backend)
+
+    config = {}
+    caches = []
+    threads = [threading.Thread(target=lambda: caches.append(caching.partials_cache(config)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(cache is caches[0] for cache in caches)
+
+
+def test_sqlite_backend_evicts_least_recently_used(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(caching.time, 'time', lambda: now[0])
+    backend = caching.SQLiteCacheBackend(str(tmp_path / 'cache.db'), max_size=1000)
+
+    for index in range(3):
+        backend.set('key%d' % index, u'\xe8' * 150, tags=['tag'])
+        now[0] += 10
+    assert backend.get('key0') == u'\xe8' * 150
+    now[0] += 10
+
+    # Sizes are measured in bytes and checked on every set
+    backend.set('key4', u'x' * 300)
+    assert backend.get('key1') is None
+    assert backend.get('key0') is not None
+    assert backend.get('key2') is not None
+    assert backend.get('key4') is not None
+    stored = backend._connection().execute('SELECT SUM(size) FROM entries').fetchone()[0]
+    assert stored <= 1000
+
+    backend.invalidate(['tag'])
+    assert backend.get('key0') is None
+    assert backend.get('key4') is not None
+
+
+def test_sqlite_backend_file_permissions(tmp_path):
+    filename = tmp_path / 'cache.db'
+    backend = caching.SQLiteCacheBackend(str(filename))
+    backend.set('key', u'value')
+    assert backend.get('key') == u'value'
+    assert stat.S_IMODE(os.stat(str(filename)).st_mode) == 0o600
+
+    os.chmod(str(filename), 0o666)
+    with pytest.raises(ValueError):
+        caching.SQLiteCacheBackend(str(filename)).get('key')
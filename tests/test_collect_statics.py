@@ -0,0 +1,38 @@
+import argparse
+import json
+import os
+
+from tgext.pluggable.commands.collect import command
+from conftest import make_app
+
+
+def collect(monkeypatch, output, clean=False):
+    monkeypatch.setattr(command, 'loadapp', lambda *args, **kwargs: make_app(plug_options={}))
+    opts = argparse.Namespace(config='test.ini', output=str(output), link=False,
+                              compress=True, min_size=512, clean=clean)
+    command.CollectStaticsCommand(None, None).take_action(opts)
+
+
+def test_collect_statics(monkeypatch, tmp_path, capsys):
+    collect(monkeypatch, tmp_path)
+    statics_root = tmp_path / '_pluggable'
+    assert (statics_root / 'plugtest' / 'css' / 'style.css').read_text() == 'body{color:red}\n'
+    manifest = json.loads((statics_root / 'manifest.json').read_text())
+    assert list(manifest['plugtest']) == ['/css/style.css']
+
+    (statics_root / 'plugtest' / 'css' / 'renamed.css').write_text(u'old')
+    (statics_root / 'unplugged' / 'js').mkdir(parents=True)
+    (statics_root / 'unplugged' / 'js' / 'app.js').write_text(u'old')
+
+    collect(monkeypatch, tmp_path)
+    output = capsys.readouterr().out
+    assert '2 stale files' in output
+    assert os.path.join('plugtest', 'css', 'renamed.css') in output
+    assert (statics_root / 'unplugged' / 'js' / 'app.js').exists()
+
+    collect(monkeypatch, tmp_path, clean=True)
+    assert '2 stale files removed' in capsys.readouterr().out
+    assert not (statics_root / 'plugtest' / 'css' / 'renamed.css').exists()
+    assert not (statics_root / 'unplugged').exists()
+    assert (statics_root / 'plugtest' / 'css' / 'style.css').exists()
+    assert (statics_root / 'manifest.json').exists()
@@ -0,0 +1,59 @@
+from tg import expose
+
+from tgext.pluggable import defer_partial, deferred_partials, deferred_partials_loader
+from conftest import make_app
+from hostapp.controllers.root import RootController as HostRootController
+
+from lxml import html
+
+
+class RootController(HostRootController):
+    # The partials endpoint is mounted on the root of the host application
+    @expose()
+    def page(self):
+        return defer_partial('plugtest.partials:something', name='deferred') + deferred_partials_loader()
+
+
+def make_deferred_app(mode='placeholder', **options):
+    options.setdefault('tgext.pluggable.partials_secret', 'secret')
+    return make_app(RootController(), plug_options={},
+                    **dict(options, **{'tgext.pluggable.deferred_partials': mode}))
+
+
+def placeholder_url(text):
+    return html.fragment_fromstring(text, create_parent=True)[0].get('data-pluggable-partial')
+
+
+def test_deferred_partial_placeholder(partials_calls):
+    app = make_deferred_app()
+    text = app.get('/page').text
+    assert '<script>' in text
+    assert partials_calls == []
+
+    assert 'Hello deferred' in app.get(placeholder_url(text)).text
+    assert partials_calls == ['deferred']
+
+
+def test_deferred_partial_esi():
+    text = make_deferred_app('esi').get('/page').text
+    assert text.startswith('<esi:include src="/_pluggable_partials/?')
+
+
+def test_deferred_partial_signature_rejected():
+    app = make_deferred_app()
+    url = placeholder_url(app.get('/page').text)
+
+    app.get(url.replace('deferred', 'tampered'), status=403)
+    app.get(url.replace('something', 'cached'), status=403)
+    app.get(url.replace('signature=', 'signature=0'), status=403)
+    app.get('/_pluggable_partials/', status=400)
+
+
+def test_deferred_partial_expired(monkeypatch):
+    app = make_deferred_app(**{'tgext.pluggable.deferred_partials_expire': 60})
+    url = placeholder_url(app.get('/page').text)
+    app.get(url, status=200)
+
+    now = deferred_partials.time.time()
+    monkeypatch.setattr(deferred_partials.time, 'time', lambda: now + 120)
+    app.get(url, status=403)
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from gettext import NullTranslations
+
+import pytest
+import tg
+from tg import expose, TGController
+
+from tgext.pluggable import i18n
+from conftest import make_app
+
+MESSAGES = ['hello', 'bye', 'only_fr', 'apple', 'missing']
+
+
+def translations(translator):
+    return ([translator.gettext(message) for message in MESSAGES] +
+            [translator.pgettext('ctx', 'bye'),
+             translator.ngettext('apple', 'apples', 1),
+             translator.ngettext('apple', 'apples', 2)])
+
+
+class RootController(TGController):
+    @expose('json')
+    def translations(self):
+        merged = translations(tg.translator)
+        return dict(merged=merged, chained=translations(tg.translator._chain()))
+
+    @expose()
+    def message(self, message):
+        return tg.translator.gettext(message)
+
+    @expose()
+    def fallback(self):
+        tg.translator.add_fallback(NullTranslations())
+        return tg.translator.gettext('bye')
+
+
+@pytest.fixture
+def loaded_translators(monkeypatch):
+    """Languages pluggables translators were loaded for"""
+    monkeypatch.setattr(i18n, '_TRANSLATORS_CACHE', OrderedDict())
+    loaded = []
+    translator_for_pluggable = i18n._translator_for_pluggable
+
+    def _translator_for_pluggable(langs, pluggable_name):
+        loaded.append(langs)
+        return translator_for_pluggable(langs, pluggable_name)
+    monkeypatch.setattr(i18n, '_translator_for_pluggable', _translator_for_pluggable)
+    return loaded
+
+
+def get(app, url, langs):
+    return app.get(url, headers={'Accept-Language': langs})
+
+
+def test_translators_cached_per_languages(loaded_translators):
+    app = make_app(RootController(), plug_options={}, i18n=True,
+                   **{'tgext.pluggable.translators_cache_size': 2})
+    for langs in ('it', 'it, fr', 'it', 'it, fr'):
+        get(app, '/translations', langs)
+    assert loaded_translators == [('it',), ('it', 'fr')]
+
+    # Fallbacks of the request translator are not appended to the cached ones
+    cached = i18n._TRANSLATORS_CACHE[('plugtest', ('it', 'fr'))]
+    chain_length = len(list(i18n._translators_chain(cached)))
+    assert get(app, '/fallback', 'it, fr').text == 'addio plug'
+    assert get(app, '/fallback', 'it, fr').text == 'addio plug'
+    assert len(list(i18n._translators_chain(cached))) == chain_length
+
+    get(app, '/translations', 'fr')
+    assert list(i18n._TRANSLATORS_CACHE) == [('plugtest', ('it', 'fr')), ('plugtest', ('fr',))]
+
+
+def test_merged_catalog_same_as_translators_chain(loaded_translators):
+    app = make_app(RootController(), plug_options={}, i18n=True)
+    resp = get(app, '/translations', 'it, fr').json
+    assert resp['merged'] == ['ciao host', 'addio plug', 'seulement', 'mela', 'missing',
+                              'addio ctx', 'mela', 'mele']
+    assert resp['merged'] == resp['chained']
+
+    for langs in ('fr', 'en', 'fr, it'):
+        resp = get(app, '/translations', langs).json
+        assert resp['merged'] == resp['chained']
+    assert len(tg.config['tgext.pluggable.catalogs_cache']) == 4
+
+
+def test_pluggables_translations_resolved_on_first_miss(loaded_translators):
+    app = make_app(RootController(), plug_options={}, i18n=True)
+    assert get(app, '/message?message=hello', 'it').text == 'ciao host'
+    assert loaded_translators == []
+    assert get(app, '/message?message=bye', 'it').text == 'addio plug'
+    assert loaded_translators == [('it',)]
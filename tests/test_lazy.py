@@ -0,0 +1,53 @@
+import sys
+
+import pytest
+import tg
+from tg import expose
+
+from tgext.pluggable import call_partial
+from tgext.pluggable.lazy import LazyController
+from conftest import make_app
+from hostapp.controllers.root import RootController as HostRootController
+
+SUBMODULES = ('controllers', 'helpers', 'partials')
+
+
+class RootController(HostRootController):
+    # Pluggables are mounted on the root of the host application
+    @expose()
+    def helper(self):
+        return tg.config['helpers'].plugtest.hello()
+
+    @expose()
+    def partial(self):
+        return call_partial('plugtest.partials:something', name='lazy')
+
+
+@pytest.fixture
+def unimported_submodules(monkeypatch):
+    """Submodules of plugtest that were not imported yet"""
+    import plugtest
+    for name in SUBMODULES:
+        monkeypatch.delitem(sys.modules, 'plugtest.' + name, raising=False)
+        monkeypatch.delattr(plugtest, name, raising=False)
+
+    def unimported():
+        return [name for name in SUBMODULES if 'plugtest.' + name not in sys.modules]
+    return unimported
+
+
+def test_lazy_pluggable_imported_on_first_use(unimported_submodules):
+    app = make_app(RootController(), plug_options={'lazy': True})
+    assert unimported_submodules() == list(SUBMODULES)
+    assert isinstance(HostRootController.plugtest, LazyController)
+
+    assert app.get('/plugtest/').text == 'plugtest root'
+    assert unimported_submodules() == ['helpers', 'partials']
+    assert not isinstance(HostRootController.plugtest, LazyController)
+    assert 'Hello little' in app.get('/plugtest/little').text
+
+    assert app.get('/helper').text == 'hello'
+    assert unimported_submodules() == ['partials']
+
+    assert 'Hello lazy' in app.get('/partial').text
+    assert unimported_submodules() == []
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+import tg
+from tg import expose, TGController
+
+from tgext.pluggable import call_partial, call_partials, replace_template
+from conftest import make_app
+
+
+class RootController(TGController):
+    @expose()
+    def batch(self):
+        tg.tmpl_context.value = 'page'
+        output = call_partials([('plugtest.partials:something', {'name': 'a'}),
+                                'plugtest.partials:context_value',
+                                ('plugtest.partials:nested', {'name': 'n'})])
+        return '|'.join(output + [tg.tmpl_context.value])
+
+    @expose()
+    def slow(self):
+        try:
+            call_partials(['plugtest.partials:slow'] * 6, timeout=0.1)
+        except TimeoutError:
+            return 'timeout'
+        return 'completed'
+
+
+def test_batch_rendered_in_order(partials_calls):
+    text = make_app(RootController(), plug_options={}).get('/batch').text
+    outputs = text.split('|')
+    assert 'Hello a' in outputs[0]
+    assert outputs[1] == '/batch'
+    assert outputs[2].count('Hello n') == 3
+    # Each partial has its own template context
+    assert outputs[3] == 'page'
+
+
+def test_batch_timeout(partials_calls):
+    from plugtest.partials import RELEASE_SLOW
+    RELEASE_SLOW.clear()
+
+    app = make_app(RootController(), plug_options={})
+    assert app.get('/slow').text == 'timeout'
+
+    RELEASE_SLOW.set()
+    for _ in range(100):
+        if len(partials_calls) >= 4:
+            break
+        time.sleep(0.02)
+    time.sleep(0.05)
+
+    # Partials that didn't start were cancelled and the running ones
+    # lost access to the request that already completed.
+    assert partials_calls == ['slow-detached'] * 4
+
+
+class PartialsRootController(TGController):
+    @expose()
+    def box(self):
+        return call_partial('plugtest.partials.Widgets:box', name='widget')
+
+
+def test_partials_controllers_created_on_first_use(partials_calls):
+    app = make_app(PartialsRootController(), plug_options={})
+    assert partials_calls == []
+    assert 'Hello widget' in app.get('/box').text
+    assert 'Hello widget' in app.get('/box').text
+    assert partials_calls == ['widgets']
+
+
+def test_broken_partials_detected_at_startup():
+    def replace_little(engine):
+        def setup(configurator):
+            replace_template(configurator, 'plugtest.templates.little', engine + ':plugtest.templates.missing')
+        return setup
+
+    with pytest.raises(ValueError, match='Template plugtest.templates.missing of partial plugtest.partials:'):
+        make_app(plug_options={}, setup=replace_little('kajiki'))
+    with pytest.raises(ValueError, match='with the genshi renderer, which is not enabled'):
+        make_app(plug_options={}, setup=replace_little('genshi'))
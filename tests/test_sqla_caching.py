@@ -0,0 +1,72 @@
+import pytest
+from tg import expose, TGController
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+from sqlalchemy import Column, Integer, create_engine
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+
+from tgext.pluggable import call_partial
+from conftest import make_app
+
+DeclarativeBase = declarative_base()
+
+
+class Article(DeclarativeBase):
+    __tablename__ = 'articles'
+    uid = Column(Integer, primary_key=True)
+
+
+class RootController(TGController):
+    def __init__(self, DBSession):
+        self.DBSession = DBSession
+
+    @expose()
+    def articles(self):
+        return call_partial('plugtest.partials:articles')
+
+    @expose()
+    def add(self, rollback=False):
+        self.DBSession.add(Article())
+        if rollback:
+            self.DBSession.rollback()
+        else:
+            self.DBSession.commit()
+        return 'OK'
+
+
+@pytest.fixture
+def DBSession():
+    engine = create_engine('sqlite://')
+    DeclarativeBase.metadata.create_all(engine)
+    DBSession = scoped_session(sessionmaker(bind=engine))
+    yield DBSession
+    DBSession.remove()
+
+
+def make_sqla_app(DBSession):
+    return make_app(RootController(DBSession), plug_options={},
+                    use_sqlalchemy=True, DBSession=DBSession)
+
+
+def test_commit_invalidates_partials(DBSession, partials_calls):
+    app = make_sqla_app(DBSession)
+    app.get('/articles')
+    app.get('/articles')
+    app.get('/add', params={'rollback': 1})
+    app.get('/articles')
+    assert partials_calls == ['articles']
+
+    app.get('/add')
+    app.get('/articles')
+    assert partials_calls == ['articles', 'articles']
+
+
+def test_commit_invalidates_partials_of_each_app(DBSession, partials_calls):
+    first = make_sqla_app(DBSession)
+    second = make_sqla_app(DBSession)
+    first.get('/articles')
+    second.get('/articles')
+
+    second.get('/add')
+    second.get('/articles')
+    assert partials_calls == ['articles', 'articles', 'articles']
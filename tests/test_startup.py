@@ -0,0 +1,22 @@
+import itertools
+
+import tg
+
+from tgext.pluggable import startup
+from conftest import make_app
+
+
+def test_startup_report(monkeypatch):
+    # Each measurement of a phase lasts exactly one second
+    ticks = itertools.count()
+    monkeypatch.setattr(startup, '_timer', lambda: next(ticks))
+
+    make_app(plug_options={})
+    report = tg.config['tgext.pluggable.plugged'].startup_report()
+
+    assert [entry['pluggable'] for entry in report] == ['plugtest']
+    phases = dict((phase.name, phase) for phase in report[0]['phases'])
+    assert set(phases) == set(['import', 'plugme', 'submodules', 'helpers', 'controllers',
+                               'partials', 'statics'])
+    assert all(phase.duration == 1 for phase in phases.values())
+    assert report[0]['total'].duration == len(phases)
@@ -0,0 +1,278 @@
+import mimetypes
+import os
+
+import tg
+from tg import expose, TGController
+from webob import Request
+from webob.static import DirectoryApp
+from webtest import TestApp
+
+from tgext.pluggable.adapt_statics import (OffloadedStatics, PluggedStaticsMiddleware,
+                                          PrecompressedStatics, StaticsCache, StaticsManifest,
+                                          StreamingStatics)
+from tgext.pluggable import plug_static_url
+from conftest import make_app
+
+PUBLIC_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'plugtest', 'public')
+
+
+def host_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'host']
+
+
+def forbidding_middleware(app, public_path):
+    def middleware(environ, start_response):
+        if 'HTTP_AUTHORIZATION' not in environ:
+            start_response('401 Unauthorized', [('Content-Length', '0')])
+            return []
+        return app(environ, start_response)
+    return middleware
+
+
+def test_offloaded_statics():
+    app = make_app(plug_options={}, **{'tgext.pluggable.statics_offload': 'x-sendfile'})
+    resp = app.get('/_pluggable/plugtest/css/style.css')
+    assert resp.headers['X-Sendfile'].endswith('/plugtest/public/css/style.css')
+    assert resp.headers['Content-Type'] == 'text/css'
+    assert resp.body == b''
+
+
+def test_offloaded_statics_middlewares():
+    app = make_app(plug_options={'static_middlewares': [forbidding_middleware]},
+                   **{'tgext.pluggable.statics_offload': 'x-sendfile'})
+    app.get('/_pluggable/plugtest/css/style.css', status=401)
+    resp = app.get('/_pluggable/plugtest/css/style.css', headers={'Authorization': 'yes'})
+    assert 'X-Sendfile' in resp.headers
+
+
+def test_offloaded_statics_outside_public(tmp_path):
+    public = tmp_path / 'public'
+    public.mkdir()
+    (public / 'subdir').mkdir()
+    (tmp_path / 'secret.txt').write_text(u'secret')
+    os.symlink(str(tmp_path / 'secret.txt'), str(public / 'link.txt'))
+
+    app = TestApp(OffloadedStatics(str(public), 'x-sendfile'))
+    app.get('/link.txt', status=403)
+    app.get('/../secret.txt', status=403)
+    app.get('/subdir', status=404)
+    app.get('/missing.txt', status=404)
+
+
+def test_statics_of_plain_plugged_registry():
+    plugged = {'modules': {'plugtest': {'statics': DirectoryApp(PUBLIC_PATH)}}}
+    app = TestApp(PluggedStaticsMiddleware(host_app, plugged))
+    assert app.get('/_pluggable/plugtest/css/style.css').text == 'body{color:red}\n'
+    assert app.get('/index.html').text == 'host'
+    assert app.get('/_pluggable/unknown/style.css').text == 'host'
+
+
+def make_precompressed_public(tmp_path):
+    public = tmp_path / 'public'
+    public.mkdir()
+    (public / 'style.css').write_bytes(b'body{color:red}' * 100)
+    (public / 'style.css.br').write_bytes(b'brotli')
+    (public / 'style.css.gz').write_bytes(b'gzip')
+    return str(public)
+
+
+def test_precompressed_statics(tmp_path, monkeypatch):
+    # Not relying on the process wide mimetypes tables
+    monkeypatch.delitem(mimetypes.encodings_map, '.br', raising=False)
+    public = make_precompressed_public(tmp_path)
+    app = PrecompressedStatics(DirectoryApp(public), public)
+
+    def get(path, **headers):
+        # Not through TestApp, which decodes the responses
+        return Request.blank(path, headers=headers).get_response(app)
+
+    resp = get('/style.css', **{'Accept-Encoding': 'gzip, br'})
+    assert resp.body == b'brotli'
+    assert resp.headers['Content-Encoding'] == 'br'
+    assert resp.headers['Content-Type'].startswith('text/css')
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+
+    resp = get('/style.css', **{'Accept-Encoding': 'gzip, br;q=0'})
+    assert resp.body == b'gzip'
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Content-Type'].startswith('text/css')
+
+    resp = get('/style.css')
+    assert resp.body == b'body{color:red}' * 100
+    assert 'Content-Encoding' not in resp.headers
+
+
+def test_manifest_conditional_and_range_requests(tmp_path):
+    public = tmp_path / 'public'
+    public.mkdir()
+    data = public / 'data.bin'
+    data.write_bytes(b'0123456789' * 100)
+
+    manifest = StaticsManifest(str(public))
+    statics = StreamingStatics(DirectoryApp(str(public)), str(public))
+    plugged = {'modules': {'plugtest': {'statics': statics, 'statics_manifest': manifest}}}
+    app = TestApp(PluggedStaticsMiddleware(host_app, plugged))
+    file_info = manifest.get('/data.bin')
+
+    # Files are not hashed for requests without a fingerprint
+    resp = app.get('/_pluggable/plugtest/data.bin', headers={'Range': 'bytes=10-19'}, status=206)
+    assert resp.body == b'0123456789'
+    assert not file_info.hashed
+    app.get('/_pluggable/plugtest/data.bin', headers={'If-None-Match': resp.headers['ETag']},
+            status=304)
+
+    resp = app.get('/_pluggable/plugtest/data.bin?v=' + file_info.fingerprint)
+    assert resp.headers['Cache-Control'] == PluggedStaticsMiddleware.IMMUTABLE_CACHE_CONTROL
+    etag = resp.headers['ETag']
+    assert etag == file_info.etag
+    app.get('/_pluggable/plugtest/data.bin', headers={'If-None-Match': etag}, status=304)
+    resp = app.get('/_pluggable/plugtest/data.bin', headers={'Range': 'bytes=0-3', 'If-Range': etag},
+                   status=206)
+    assert resp.body == b'0123'
+
+    # Changes on disk are detected before answering with 304
+    data.write_bytes(b'changed')
+    mtime = os.stat(str(data)).st_mtime + 10
+    os.utime(str(data), (mtime, mtime))
+    resp = app.get('/_pluggable/plugtest/data.bin', headers={'If-None-Match': etag})
+    assert resp.body == b'changed'
+    resp = app.get('/_pluggable/plugtest/data.bin', headers={'Range': 'bytes=0-3', 'If-Range': etag})
+    assert resp.body == b'changed'
+    assert resp.headers['ETag'] != etag
+
+    data.unlink()
+    app.get('/_pluggable/plugtest/data.bin', status=404)
+
+
+def test_statics_cache(tmp_path):
+    public = tmp_path / 'public'
+    public.mkdir()
+    for name in ('a.css', 'b.css', 'c.css'):
+        (public / name).write_bytes(name.encode('ascii') * 25)
+    (public / 'big.bin').write_bytes(b'x' * 300)
+
+    cache = StaticsCache(DirectoryApp(str(public)), str(public), max_size=250,
+                         max_file_size=200, check_interval=60)
+    app = TestApp(cache)
+
+    resp = app.get('/a.css')
+    assert resp.body == b'a.css' * 25
+    assert resp.headers['Content-Type'].startswith('text/css')
+    app.get('/a.css', headers={'If-None-Match': resp.headers['ETag']}, status=304)
+    app.get('/a.css', headers={'If-Modified-Since': resp.headers['Last-Modified']}, status=304)
+
+    # Served from memory until the modification time is checked again
+    (public / 'a.css').write_bytes(b'changed')
+    mtime = os.stat(str(public / 'a.css')).st_mtime + 10
+    os.utime(str(public / 'a.css'), (mtime, mtime))
+    assert app.get('/a.css').body == b'a.css' * 25
+    cache.check_interval = 0
+    assert app.get('/a.css').body == b'changed'
+    cache.check_interval = 60
+
+    # Least recently used files are evicted, big files are never cached
+    app.get('/b.css')
+    app.get('/a.css')
+    app.get('/c.css')
+    assert list(cache._entries) == ['/a.css', '/c.css']
+    assert cache.size == len(b'changed') + 125
+    assert app.get('/big.bin').body == b'x' * 300
+    assert '/big.bin' not in cache._entries
+
+    app = make_app(plug_options={'statics_cache_size': 1024})
+    assert app.get('/_pluggable/plugtest/css/style.css').text == 'body{color:red}\n'
+    statics = tg.config['tgext.pluggable.plugged']['modules']['plugtest']['statics']
+    assert list(statics._entries) == ['/css/style.css']
+
+
+class FileWrapper(object):
+    def __init__(self, f, block_size):
+        self.file = f
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter(lambda: self.file.read(self.block_size), b'')
+
+    def close(self):
+        self.file.close()
+
+
+def test_streaming_statics_ranges(tmp_path):
+    public = tmp_path / 'public'
+    public.mkdir()
+    content = bytes(bytearray(range(256))) * 4
+    (public / 'media.bin').write_bytes(content)
+    app = StreamingStatics(DirectoryApp(str(public)), str(public))
+
+    def get(**headers):
+        req = Request.blank('/media.bin', headers=headers)
+        req.environ['wsgi.file_wrapper'] = FileWrapper
+        status, headers, app_iter = req.call_application(app)
+        try:
+            return status, dict(headers), app_iter, b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    # Whole files and ranges up to the end of the file go through file_wrapper
+    status, headers, app_iter, body = get()
+    assert (status, body) == ('200 OK', content)
+    assert isinstance(app_iter, FileWrapper)
+    status, headers, app_iter, body = get(Range='bytes=-24')
+    assert (status, body) == ('206 Partial Content', content[-24:])
+    assert headers['Content-Range'] == 'bytes 1000-1023/1024'
+    assert isinstance(app_iter, FileWrapper)
+
+    status, headers, app_iter, body = get(Range='bytes=10-19')
+    assert (status, body) == ('206 Partial Content', content[10:20])
+    assert headers['Content-Length'] == '10'
+    assert not isinstance(app_iter, FileWrapper)
+
+    # Overlapping ranges are merged
+    status, headers, app_iter, body = get(Range='bytes=0-9,5-14,100-109')
+    boundary = headers['Content-Type'].split('boundary=')[1]
+    assert headers['Content-Type'].startswith('multipart/byteranges')
+    assert int(headers['Content-Length']) == len(body)
+    parts = body.split(b'--' + boundary.encode('ascii'))
+    assert len(parts) == 4 and parts[-1] == b'--\r\n'
+    assert b'Content-Range: bytes 0-14/1024\r\n\r\n' + content[0:15] + b'\r\n' in parts[1]
+    assert b'Content-Range: bytes 100-109/1024\r\n\r\n' + content[100:110] + b'\r\n' in parts[2]
+
+    status, headers, app_iter, body = get(Range='bytes=2000-')
+    assert status.startswith('416') and headers['Content-Range'] == 'bytes */1024'
+
+    # Ranges are ignored when If-Range doesn't match the file anymore
+    etag = get()[1]['ETag']
+    assert get(Range='bytes=0-9', **{'If-Range': etag})[0].startswith('206')
+    assert get(Range='bytes=0-9', **{'If-Range': '"other"'})[3] == content
+    assert get(**{'If-None-Match': etag})[0].startswith('304')
+
+
+def test_streaming_statics_plugged():
+    app = make_app(plug_options={'statics_streaming': True})
+    resp = app.get('/_pluggable/plugtest/css/style.css', headers={'Range': 'bytes=5-9'}, status=206)
+    assert resp.body == b'color'
+    app.get('/_pluggable/plugtest/css/missing.css', status=404)
+
+
+class StaticUrlController(TGController):
+    @expose()
+    def style_url(self):
+        return plug_static_url('plugtest', 'css/style.css')
+
+
+def test_fingerprinted_static_urls():
+    app = make_app(StaticUrlController(), plug_options={'statics_manifest': True})
+    url = app.get('/style_url').text
+    assert url.startswith('/_pluggable/plugtest/css/style.css?v=')
+
+    resp = app.get(url)
+    assert resp.text == 'body{color:red}\n'
+    assert resp.headers['Cache-Control'] == PluggedStaticsMiddleware.IMMUTABLE_CACHE_CONTROL
+    resp = app.get(url, headers={'If-None-Match': resp.headers['ETag']}, status=304)
+    assert resp.headers['Cache-Control'] == PluggedStaticsMiddleware.IMMUTABLE_CACHE_CONTROL
+
+    # Outdated fingerprints are not cached forever
+    resp = app.get('/_pluggable/plugtest/css/style.css?v=000000000000')
+    assert resp.headers.get('Cache-Control') != PluggedStaticsMiddleware.IMMUTABLE_CACHE_CONTROL
@@ -0,0 +1,147 @@
+import logging
+
+import tg
+from tg import expose, TGController
+
+from tgext.pluggable import template_patching
+from tgext.pluggable.template_patching import (Action, Patch, PatchesMatcher, patch_content,
+                                               init_template_patches, KajikiPatchesCompiler)
+from conftest import make_app
+
+template_patching._import_etree()
+from lxml import html
+
+PAGE = ('<!DOCTYPE html><html><head><title>Page</title></head><body>'
+        '<div id="menu"><ul class="nav"><li class="first">Home</li><li>About</li></ul></div>'
+        '<div class="banner">Banner</div><p class="notice">Notice</p>'
+        '<div id="content"><h1>Title</h1><p>Text</p></div>'
+        '<div id="footer"><span class="copyright">(c)</span></div>'
+        '</body></html>')
+
+CONTENTS = {
+    'entry': '<li class="extra">Extra</li>',
+    'note': '<p class="note">Note</p>',
+    'empty': '',
+}
+
+
+def action_fragment(action):
+    if action.template is None:
+        return None
+    return action.fragment({}, lambda: CONTENTS[action.template])
+
+
+def patch(actions, streaming_size):
+    output = patch_content(PatchesMatcher(actions), PAGE, action_fragment, streaming_size)
+    if not isinstance(output, bytes):
+        output = b''.join(output)
+    return html.tostring(html.document_fromstring(output))
+
+
+def assert_same_output(actions):
+    assert patch(actions, None) == patch(actions, 0)
+
+
+def test_streaming_same_as_tree():
+    actions = [
+        Action('append', '#menu ul.nav > li.first', 'entry'),
+        Action('prepend', '#content h1', 'note'),
+        Action('content', '#footer', 'note'),
+        Action('replace', '.banner', None),
+        Action('replace', 'p.notice', 'empty'),
+    ]
+    assert PatchesMatcher(actions).streaming_fragments(action_fragment) is not None
+    assert_same_output(actions)
+
+
+def test_streaming_matches_inserted_content():
+    actions = [
+        Action('append', '#menu li.first', 'entry'),
+        Action('content', 'li.extra', 'note'),
+        Action('prepend', '#footer p.note', 'entry'),
+    ]
+    assert PatchesMatcher(actions).streaming_fragments(action_fragment) is None
+    assert_same_output(actions)
+    assert b'<li class="extra"><p class="note">Note</p></li>' in patch(actions, 0)
+
+
+def test_streaming_is_incremental():
+    actions = [Action('append', '#menu li.first', 'entry'),
+               Action('replace', '.banner', None)]
+    output = patch_content(PatchesMatcher(actions), PAGE, action_fragment, 0)
+    assert not isinstance(output, bytes)
+    assert b'<li class="extra">Extra</li>' in next(output)
+
+
+def test_malformed_pages_patched_as_tree():
+    actions = [Action('append', '#menu li.first', 'entry'),
+               Action('prepend', 'div p', 'note'),
+               Action('content', 'body > div', 'note')]
+    pages = [
+        '<html><body><div id="menu"><ul><li class="first">Home<li>About</ul></div>'
+        '<p>a<p>b<div>c</div></body></html>',
+        '<html><body><div id="menu"></span><ul><li class="first">Home</li></ul></div></p>'
+        '</body></html>',
+        '<div id="menu"><ul><li class="first">Home</li></ul></div><div><p>x</p></div>',
+    ]
+    for page in pages:
+        tree = patch_content(PatchesMatcher(actions), page, action_fragment, None)
+        output = patch_content(PatchesMatcher(actions), page, action_fragment, 0)
+        assert output == tree
+
+
+class PatchedController(TGController):
+    @expose('kajiki:hostapp.templates.page')
+    def page(self):
+        return dict(items=['a', 'b'], content='c')
+
+    @expose('kajiki:hostapp.templates.child')
+    def child(self):
+        return dict(items=['a', 'b'], content='c')
+
+
+def make_patched_app(template, actions, **options):
+    def setup(configurator):
+        patch = Patch(template)
+        for action in actions:
+            patch.add_action(action)
+        configurator.update_blueprint({'_pluggable_templates_patches': {template: [patch]},
+                                       '_pluggable_templates_patches_files': []})
+        tg.hooks.register('initialized_config', init_template_patches)
+    options.setdefault('tgext.pluggable.compile_template_patches', 'true')
+    return make_app(PatchedController(), setup=setup, **options)
+
+
+def test_compiled_patches():
+    app = make_patched_app('hostapp.templates.page', [
+        Action('append', '#footer', 'kajiki:hostapp.templates.after'),
+        Action('append', 'ul.nav > li', 'kajiki:hostapp.templates.menuentry'),
+    ])
+    text = app.get('/page').text
+    assert isinstance(tg.config['render_functions']['kajiki'].loader, KajikiPatchesCompiler)
+    # The second action matches elements generated by py:for
+    assert len(tg.config['_pluggable_templates_runtime_patches']['hostapp.templates.page']) == 1
+    assert '<div id="footer">f</div>\n<span class="after">after</span>' in text
+    assert text.count('Extra c') == 2
+
+
+def test_extending_templates_not_compiled(caplog):
+    app = make_patched_app('hostapp.templates.child', [
+        Action('append', '#footer', 'kajiki:hostapp.templates.after'),
+    ])
+    with caplog.at_level(logging.INFO, logger='tgext.pluggable'):
+        text = app.get('/child').text
+    assert 'Template patches of hostapp.templates.child not compiled' in caplog.text
+    assert len(tg.config['_pluggable_templates_runtime_patches']['hostapp.templates.child']) == 1
+    assert '<span class="after">after</span>' in text
+    # Templates without patches are loaded by the renderer loader
+    assert 'class="after"' not in app.get('/page').text
+
+
+def test_static_fragments_cached_per_language():
+    app = make_patched_app('hostapp.templates.page', [
+        Action('append', '#footer', 'kajiki:hostapp.templates.greeting', 'static'),
+    ], i18n=True, **{'tgext.pluggable.compile_template_patches': 'false'})
+    assert '<span class="greeting">ciao host</span>' in app.get('/page', headers={'Accept-Language': 'it'}).text
+    assert '<span class="greeting">hello</span>' in app.get('/page', headers={'Accept-Language': 'en'}).text
+    assert '<span class="greeting">ciao host</span>' in app.get('/page', headers={'Accept-Language': 'it'}).text
@@ -0,0 +1,70 @@
+from tg import expose, TGController
+from tg.decorators import override_template, use_custom_format
+
+from tgext.pluggable import replace_template, template_replacements
+from conftest import make_app
+
+
+def replace_little(configurator):
+    replace_template(configurator, 'plugtest.templates.little', 'hostapp.templates.replaced')
+
+
+class BaseController(TGController):
+    @expose('kajiki:plugtest.templates.little')
+    def inherited(self):
+        return dict(name='inherited')
+
+
+class StaticRootController(BaseController):
+    @expose('kajiki:plugtest.templates.little')
+    @expose('kajiki:plugtest.templates.little', custom_format='custom')
+    def custom(self):
+        use_custom_format(self.custom, 'custom')
+        return dict(name='custom')
+
+    @expose('kajiki:hostapp.templates.after')
+    def over(self):
+        override_template(StaticRootController.over, 'kajiki:plugtest.templates.little')
+        return dict(name='over')
+
+
+class LookedUpController(TGController):
+    @expose('kajiki:plugtest.templates.little')
+    def index(self):
+        return dict(name='lookup')
+
+
+class DynamicRootController(StaticRootController):
+    @expose()
+    def _lookup(self, *args):
+        return LookedUpController(), list(args[1:])
+
+
+def test_replaced_when_app_is_created(monkeypatch):
+    app = make_app(StaticRootController(), setup=replace_little)
+
+    # The walk reached everything, controllers are never looked up on render
+    def unexpected(req):
+        raise AssertionError('dispatched controller looked up')
+    monkeypatch.setattr(template_replacements, '_dispatched_controller', unexpected)
+
+    assert 'Replaced inherited' in app.get('/inherited').text
+    assert 'Replaced custom' in app.get('/custom').text
+
+
+def test_override_template_replaced():
+    app = make_app(StaticRootController(), setup=replace_little)
+    assert 'Replaced over' in app.get('/over').text
+
+
+def test_looked_up_controllers_replaced_on_render():
+    app = make_app(DynamicRootController(), setup=replace_little)
+    assert 'Replaced lookup' in app.get('/anything/').text
+    assert 'Replaced lookup' in app.get('/anything/').text
+    assert 'Replaced over' in app.get('/over').text
+
+
+def test_plugged_controllers_replaced():
+    app = make_app(plug_options={}, setup=replace_little)
+    assert 'Replaced little' in app.get('/plugtest/little').text
+    assert app.get('/plugtest/both.json').json == {'name': 'both'}
@@ -1,8 +1,10 @@
 from .plug import plug
 from .session_wrapper import PluggableSession
-from .utils import call_partial, plug_url, plug_redirect, plugged, primary_key,\
-    instance_primary_key
+from .utils import call_partial, call_partials, plug_url, plug_static_url, plug_redirect, plugged, \
+    primary_key, instance_primary_key
 from .template_replacements import replace_template
+from .caching import cached_partial
+from .deferred_partials import defer_partial, deferred_partials_loader
 from .adapt_models import app_model
 from .template_patching import load_template_patches
 
@@ -1,5 +1,10 @@
+import threading
 from tg.wsgiapp import TGApp
 from operator import attrgetter
+from functools import partial
+
+from .lazy import LazyController
+from .template_replacements import apply_templates_replacements
 
 class ControllersAdapter(object):
     def __init__(self, config, controllers, options):
@@ -7,6 +12,7 @@ class ControllersAdapter(object):
         self.controllers = controllers
         self.options = options
         self.tgapp = None
+        self._lock = threading.Lock()
 
     def _resolve_mountpoint(self, app_id):
         tgapp = self.tgapp
@@ -30,6 +36,24 @@ class ControllersAdapter(object):
         app_id = self.options['appid']
 
         mountpoint, name = self._resolve_mountpoint(app_id)
-        setattr(mountpoint, name, self.controllers.RootController())
+        if self.options.get('lazy'):
+            controller = LazyController(partial(self._load_controller, mountpoint, name))
+        else:
+            controller = self.controllers.RootController()
+        setattr(mountpoint, name, controller)
 
         return app
+
+    def _load_controller(self, mountpoint, name):
+        with self._lock:
+            controller = getattr(mountpoint, name)
+            if isinstance(controller, LazyController):
+                controller = self.controllers.RootController()
+
+                # Replacements were applied to the mounted controllers before this one existed
+                templates_replacements = self.config.get('_pluggable_templates_replacements')
+                if templates_replacements:
+                    apply_templates_replacements(controller, templates_replacements)
+
+                setattr(mountpoint, name, controller)
+        return controller
@@ -4,6 +4,7 @@ from .session_wrapper import TargetAppModel
 
 try:
     from .sqla.models import SQLAModelsSupport
+    from .sqla.caching import invalidate_partials_on_commit
 except ImportError:
     pass
 
@@ -16,6 +17,15 @@ log = logging.getLogger('tgext.pluggable')
 app_model = TargetAppModel()
 
 
+def track_partials_dependencies(config):
+    """Invalidate cached partials when the tables they depend on are changed"""
+    DBSession = config.get('DBSession')
+    if DBSession is None or not config.get('use_sqlalchemy'):
+        return
+
+    invalidate_partials_on_commit(DBSession, config)
+
+
 class ModelsAdapter(object):
     def __init__(self, config, models, options):
         self.config = config
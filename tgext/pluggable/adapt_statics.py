@@ -1,32 +1,871 @@
-import os
+import os, stat, time, mimetypes, threading, hashlib, gzip, shutil, binascii, zlib
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_tz, mktime_tz
 try:
     from webob.static import DirectoryApp
 except ImportError:
     from paste.urlparser import StaticURLParser as DirectoryApp
 
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATICS_PREFIX = '/_pluggable/'
+
+# Requests with more ranges than this are answered with the whole file
+MAX_RANGES = 16
+
+# Precompressed variants of static files in order of preference
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+PRECOMPRESSED_TYPES = ('.css', '.js', '.json', '.map', '.svg', '.html', '.htm',
+                       '.txt', '.xml', '.ico', '.eot', '.ttf', '.otf')
+# Known locally, older Python versions don't map .br in mimetypes
+PRECOMPRESSED_EXTENSIONS = dict((extension, encoding) for encoding, extension in PRECOMPRESSED_ENCODINGS)
+
+
 class PluggedStaticsMiddleware(object):
-    def __init__(self, app, plugged):
+    """Dispatches requests under ``/_pluggable/`` to the statics of the plugged apps.
+
+    Routing is performed through a table that maps each pluggable name
+    to its statics application, to the length of the prefix that must
+    be stripped from ``PATH_INFO`` and to the :class:`StaticsManifest`
+    of the pluggable if one was built. The table is never modified in place,
+    it is replaced whenever a pluggable registers its statics.
+
+    When a manifest is available conditional requests for files listed
+    in it are answered with ``304 Not Modified`` without reaching the
+    statics application and requests whose ``v`` parameter matches the
+    fingerprint of the file are marked as cacheable forever. Files are
+    only hashed for requests with a ``v`` parameter or when their url is
+    generated, entity tags based on the hash are used from then on.
+
+    When ``offload`` is ``x-sendfile`` or ``x-accel-redirect`` the files
+    are not sent by the middleware, the response only provides
+    the header that tells the web server which file it should send.
+    For ``x-accel-redirect`` the path of the file is prefixed with
+    ``offload_prefix`` which should be an internal location of nginx
+    that maps to the root of the filesystem.
+    """
+    IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def __init__(self, app, plugged, offload=None, offload_prefix='/_pluggable_offload'):
         self.plugged = plugged
         self.app = app
 
+        if offload:
+            offload = offload.lower()
+            if offload not in OffloadedStatics.HEADERS:
+                raise ValueError('Unsupported statics offload mode: %s' % offload)
+        self.offload = offload
+        self.offload_prefix = offload_prefix.rstrip('/')
+
+        self._routes = {}
+        self._routes_revision = None
+        self._build_routes()
+
+    def _build_routes(self):
+        revision = self.plugged.get('statics_revision', 0)
+
+        routes = {}
+        for module_name, module_config in self.plugged['modules'].items():
+            statics_app = module_config.get('statics')
+            if statics_app is not None:
+                if self.offload:
+                    statics_path = module_config['statics_path']
+                    statics_app = OffloadedStatics(statics_path, self.offload, self.offload_prefix)
+                    for middleware in module_config.get('statics_middlewares', ()):
+                        statics_app = middleware(statics_app, statics_path)
+                routes[module_name] = (statics_app, len(STATICS_PREFIX + module_name),
+                                       module_config.get('statics_manifest'))
+
+        self._routes = routes
+        self._routes_revision = revision
+        return routes
+
     def __call__(self, environ, start_response):
         path_info = environ.get('PATH_INFO', '')
 
-        if not path_info.startswith('/_pluggable/'):
+        if not path_info.startswith(STATICS_PREFIX):
+            # Not a pluggable static file, the routing table is never involved
             return self.app(environ, start_response)
 
-        root_path = path_info.split('/')
-        while not root_path[0]:
-            root_path.pop(0)
-        root_path = root_path[1]
+        routes = self._routes
+        if self._routes_revision != self.plugged.get('statics_revision', 0):
+            routes = self._build_routes()
+
+        name_end = path_info.find('/', len(STATICS_PREFIX))
+        if name_end < 0:
+            name_end = len(path_info)
+
+        route = routes.get(path_info[len(STATICS_PREFIX):name_end])
+        if route is None:
+            return self.app(environ, start_response)
+
+        statics_app, prefix_length, manifest = route
+        path_info = environ['PATH_INFO'] = path_info[prefix_length:]
+
+        if manifest is not None:
+            file_info = manifest.get(path_info)
+            if file_info is not None:
+                return self._serve_with_manifest(statics_app, manifest, file_info,
+                                                 environ, start_response)
+
+        return statics_app(environ, start_response)
+
+    def _serve_with_manifest(self, statics_app, manifest, file_info, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return statics_app(environ, start_response)
+
+        if not file_info.refresh():
+            # Removed after the manifest was built
+            return statics_app(environ, start_response)
+
+        # Hashing the file is only worth it for urls that carry a fingerprint
+        versions = [param[2:] for param in environ.get('QUERY_STRING', '').split('&')
+                    if param.startswith('v=')]
+        fingerprinted = bool(versions) and file_info.fingerprint in versions
+
+        if file_info.not_modified(environ):
+            headers = [('Last-Modified', file_info.last_modified)]
+            if file_info.hashed:
+                headers.append(('ETag', file_info.etag))
+            if fingerprinted:
+                headers.append(('Cache-Control', self.IMMUTABLE_CACHE_CONTROL))
+            if environ['PATH_INFO'] in manifest.precompressed:
+                # Same Vary the full response would have
+                headers.append(('Vary', 'Accept-Encoding'))
+            start_response('304 Not Modified', headers)
+            return []
+
+        if_range = environ.get('HTTP_IF_RANGE', '').strip()
+        if if_range and file_info.hashed and if_range == file_info.etag:
+            # The statics apps don't know the manifest entity tags,
+            # while they can validate the modification time of the file.
+            environ['HTTP_IF_RANGE'] = file_info.last_modified
+
+        def _start_response(status, headers, exc_info=None):
+            if status.startswith('200') or status.startswith('206'):
+                if fingerprinted:
+                    headers = [h for h in headers if h[0].lower() != 'cache-control']
+                    headers.append(('Cache-Control', self.IMMUTABLE_CACHE_CONTROL))
+
+                if not file_info.hashed:
+                    # Keep the entity tag of the statics app until the file gets hashed
+                    return start_response(status, headers, exc_info)
+
+                etag = file_info.etag
+                for name, value in headers:
+                    if name.lower() == 'content-encoding':
+                        # Each encoding is a different representation of the file
+                        etag = '%s-%s"' % (etag[:-1], value)
+                headers = [h for h in headers if h[0].lower() != 'etag']
+                headers.append(('ETag', etag))
+            return start_response(status, headers, exc_info)
+
+        return statics_app(environ, _start_response)
+
+
+class OffloadedStatics(object):
+    """Lets the web server send the static files.
+
+    Responds with a ``X-Sendfile`` or ``X-Accel-Redirect`` header
+    pointing to the requested file inside ``public_path``.
+    Symbolic links are resolved before checking that the file
+    is inside ``public_path``, anything that is not a regular file is not found.
+    """
+    HEADERS = {'x-sendfile': 'X-Sendfile',
+               'x-accel-redirect': 'X-Accel-Redirect'}
+
+    def __init__(self, public_path, mode, prefix=''):
+        self.public_path = os.path.join(os.path.realpath(public_path), '')
+        self.header = self.HEADERS[mode]
+        self.prefix = prefix if mode == 'x-accel-redirect' else ''
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'),
+                                                      ('Content-Length', '0')])
+            return []
+
+        filename = os.path.realpath(os.path.join(self.public_path,
+                                                 environ.get('PATH_INFO', '').lstrip('/')))
+        if not filename.startswith(self.public_path):
+            start_response('403 Forbidden', [('Content-Length', '0')])
+            return []
+
+        if not os.path.isfile(filename):
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return []
+
+        content_type, content_encoding = _guess_type(filename)
+        location = filename.replace(os.sep, '/')
+        if self.prefix:
+            location = self.prefix + quote(location)
+
+        headers = [(self.header, location),
+                   ('Content-Type', content_type or 'application/octet-stream'),
+                   ('Content-Length', '0')]
+        if content_encoding:
+            headers.append(('Content-Encoding', content_encoding))
+
+        start_response('200 OK', headers)
+        return []
+
+
+class StaticFileInfo(object):
+    """Size, modification time and hash of a static file.
+
+    The hash is computed the first time it is needed, size and modification
+    time are updated at that time so that they always describe the hashed content.
+    :meth:`refresh` discards the hash when the file changed on disk.
+    """
+    __slots__ = ('fullpath', 'size', 'mtime', 'last_modified', '_digest')
+
+    BLOCK_SIZE = 1 << 16
 
-        module_config = self.plugged['modules'].get(root_path)
-        if module_config:
-            environ['PATH_INFO'] = path_info[len('/_pluggable/'+root_path):]
-            return module_config['statics'](environ, start_response)
+    def __init__(self, fullpath, size, mtime, digest=None):
+        self.fullpath = fullpath
+        self.size = size
+        self.mtime = mtime
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self._digest = digest
+
+    @property
+    def digest(self):
+        digest = self._digest
+        if digest is None:
+            digest = self._hash()
+        return digest
+
+    @property
+    def hashed(self):
+        return self._digest is not None
+
+    @property
+    def fingerprint(self):
+        return self.digest[:12]
+
+    @property
+    def etag(self):
+        return '"%s"' % self.digest
+
+    def _hash(self):
+        try:
+            st = os.stat(self.fullpath)
+        except (IOError, OSError):
+            st = None
+
+        digest = hashlib.sha1()
+        with open(self.fullpath, 'rb') as f:
+            for block in iter(lambda: f.read(self.BLOCK_SIZE), b''):
+                digest.update(block)
+
+        if st is not None and (st.st_size, st.st_mtime) != (self.size, self.mtime):
+            self.size, self.mtime = st.st_size, st.st_mtime
+            self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self._digest = digest.hexdigest()
+        return self._digest
+
+    def refresh(self):
+        """Checks size and modification time of the file against the recorded ones.
+
+        When the file changed they are updated and the hash is computed
+        again the next time it is needed. Returns ``False`` when the
+        file is no longer available.
+        """
+        try:
+            st = os.stat(self.fullpath)
+        except (IOError, OSError):
+            return False
+
+        if (st.st_size, st.st_mtime) != (self.size, self.mtime):
+            self.size, self.mtime = st.st_size, st.st_mtime
+            self.last_modified = formatdate(st.st_mtime, usegmt=True)
+            self._digest = None
+        return True
+
+    def not_modified(self, environ):
+        """Whenever the client copy of the file described by the environ is still valid.
+
+        Until the file is hashed entity tags are left to the statics application.
+        """
+        if not self.hashed:
+            if 'HTTP_IF_NONE_MATCH' in environ:
+                return False
+            return _not_modified(environ, None, self.mtime)
+        return _not_modified(environ, self.etag, self.mtime)
+
+
+def _not_modified(environ, etag, mtime):
+    """Whenever the client copy of a file with ``etag`` and ``mtime`` is still valid.
+
+    ``If-None-Match`` takes precedence over ``If-Modified-Since``, entity
+    tags of the compressed representations of the file also match.
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == '*' or candidate == etag or candidate.startswith(etag[:-1] + '-'):
+                return True
+        return False
+
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None:
+        parsed = parsedate_tz(if_modified_since)
+        if parsed is not None:
+            return int(mtime) <= mktime_tz(parsed)
+
+    return False
+
+
+def _file_etag(filename, st):
+    """Entity tag of a file computed from its path, modification time and size"""
+    if not isinstance(filename, bytes):
+        filename = filename.encode('utf-8', 'replace')
+    path_hash = zlib.crc32(filename) & 0xffffffff
+    return '"%x-%x-%x"' % (path_hash, int(st.st_mtime * 1000), st.st_size)
+
+
+class StaticsManifest(object):
+    """Describes every file available inside a pluggable public directory.
+
+    For each file the size, modification time and an hash of the
+    content are recorded. Files are listed when the manifest is created
+    while each file is hashed the first time its hash is needed, files
+    added after the manifest was created are not listed until it is
+    created again (usually restarting the application).
+
+    ``precompressed`` lists the files that are served in compressed
+    variants, as their responses vary on ``Accept-Encoding``.
+    """
+    def __init__(self, public_path):
+        self.public_path = os.path.abspath(public_path)
+        self.files = {}
+        self.precompressed = {}
+        self._scan()
+
+    def get(self, path):
+        return self.files.get(path)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def _scan(self):
+        for base, dirs, files in os.walk(self.public_path):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+
+            for filename in files:
+                if filename.endswith(('.pyc', '.pyo')):
+                    continue
+
+                fullpath = os.path.join(base, filename)
+                try:
+                    st = os.stat(fullpath)
+                except (IOError, OSError):
+                    continue
+
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+
+                path = '/' + os.path.relpath(fullpath, self.public_path).replace(os.sep, '/')
+                self.files[path] = StaticFileInfo(fullpath, st.st_size, st.st_mtime)
+
+
+class PrecompressedStatics(object):
+    """Serves the ``.br`` and ``.gz`` variants of static files when available.
+
+    Variants are detected once when the application is created, the one
+    preferred by ``Accept-Encoding`` is served by rewriting ``PATH_INFO``
+    so that the wrapped ``app`` sends the compressed file.
+    """
+    def __init__(self, app, public_path, manifest=None):
+        self.app = app
+        self.public_path = os.path.abspath(public_path)
+
+        if manifest is not None:
+            available = set(manifest.files)
         else:
+            available = set()
+            for base, dirs, files in os.walk(self.public_path):
+                relbase = os.path.relpath(base, self.public_path)
+                relbase = '/' if relbase == '.' else '/' + relbase.replace(os.sep, '/') + '/'
+                available.update(relbase + filename for filename in files)
+
+        self.variants = {}
+        for path in available:
+            encodings = tuple(encoding for encoding, extension in PRECOMPRESSED_ENCODINGS
+                              if path + extension in available)
+            if encodings:
+                self.variants[path] = encodings
+
+        if manifest is not None:
+            manifest.precompressed = self.variants
+
+    def __call__(self, environ, start_response):
+        path_info = environ.get('PATH_INFO', '')
+        encodings = self.variants.get(path_info)
+        if encodings is None:
             return self.app(environ, start_response)
 
+        accepted = _accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        served_encoding = None
+        for encoding, extension in PRECOMPRESSED_ENCODINGS:
+            if encoding in encodings and encoding in accepted:
+                environ['PATH_INFO'] = path_info + extension
+                served_encoding = encoding
+                break
+
+        def _start_response(status, headers, exc_info=None):
+            headers = list(headers)
+            if served_encoding is not None and status.startswith('2') and \
+                    not any(h[0].lower() == 'content-encoding' for h in headers):
+                # The wrapped app didn't recognize the variant, send it as the original file
+                content_type = _guess_type(path_info)[0] or 'application/octet-stream'
+                headers = [h for h in headers if h[0].lower() != 'content-type']
+                headers.append(('Content-Type', content_type))
+                headers.append(('Content-Encoding', served_encoding))
+            headers.append(('Vary', 'Accept-Encoding'))
+            return start_response(status, headers, exc_info)
+
+        return self.app(environ, _start_response)
+
+
+def _guess_type(filename):
+    """Type and encoding of ``filename``, like :func:`mimetypes.guess_type`"""
+    base, extension = os.path.splitext(filename)
+    encoding = PRECOMPRESSED_EXTENSIONS.get(extension)
+    if encoding is not None:
+        return mimetypes.guess_type(base)[0], encoding
+    return mimetypes.guess_type(filename)
+
+
+def _accepted_encodings(accept_encoding):
+    accepted = set()
+    for entry in accept_encoding.split(','):
+        encoding, _, params = entry.partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+
+        accepted.add(encoding)
+
+    if '*' in accepted:
+        accepted.update(encoding for encoding, _ in PRECOMPRESSED_ENCODINGS)
+    return accepted
+
+
+def precompress_file(filename, min_size=512):
+    """Writes the ``.gz`` and ``.br`` variants of ``filename``.
+
+    Variants are only created for files that are at least ``min_size``
+    bytes and kept only when smaller than the original file. Variants
+    that are more recent than the file are left untouched.
+    Returns the list of the variants that got written.
+    """
+    st = os.stat(filename)
+    if st.st_size < min_size:
+        return []
+
+    written = []
+    for encoding, extension in PRECOMPRESSED_ENCODINGS:
+        variant = filename + extension
+        if os.path.exists(variant):
+            if os.stat(variant).st_mtime >= st.st_mtime:
+                continue
+            # Variant might be an hardlink, never write through it.
+            os.unlink(variant)
+
+        if encoding == 'br':
+            if brotli is None:
+                continue
+            with open(filename, 'rb') as f:
+                compressed = brotli.compress(f.read())
+            with open(variant, 'wb') as f:
+                f.write(compressed)
+        else:
+            with open(filename, 'rb') as src:
+                with gzip.GzipFile(variant, 'wb', compresslevel=9, mtime=st.st_mtime) as dst:
+                    shutil.copyfileobj(src, dst)
+
+        if os.stat(variant).st_size >= st.st_size:
+            os.unlink(variant)
+            continue
+
+        os.utime(variant, (st.st_atime, st.st_mtime))
+        written.append(variant)
+
+    return written
+
+
+class CachedStaticFile(object):
+    __slots__ = ('filename', 'body', 'headers', 'mtime', 'size', 'etag', 'checked')
+
+    def __init__(self, filename, body, headers, mtime, size, etag, checked):
+        self.filename = filename
+        self.body = body
+        self.headers = headers
+        self.mtime = mtime
+        self.size = size
+        self.etag = etag
+        self.checked = checked
+
+
+class StaticsCache(object):
+    """Serves small static files from memory.
+
+    Files up to ``max_file_size`` bytes are kept in memory together with
+    their response headers, up to ``max_size`` bytes in total, evicting
+    the least recently used ones. Cached files are served without
+    touching the filesystem, their modification time is checked again
+    only once every ``check_interval`` seconds. Conditional requests
+    are answered with ``304 Not Modified`` through their ``ETag``
+    and ``Last-Modified`` headers.
+
+    Everything that cannot be cached is served by the wrapped ``app``.
+    """
+    def __init__(self, app, public_path, max_size, max_file_size=128*1024, check_interval=2):
+        self.app = app
+        self.public_path = os.path.join(os.path.abspath(public_path), '')
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD') or 'HTTP_RANGE' in environ:
+            return self.app(environ, start_response)
+
+        path_info = environ.get('PATH_INFO', '')
+        entry = self._get(path_info)
+        if entry is None:
+            return self.app(environ, start_response)
+
+        if _not_modified(environ, entry.etag, entry.mtime):
+            start_response('304 Not Modified', [h for h in entry.headers
+                                                 if h[0] in ('ETag', 'Last-Modified')])
+            return []
+
+        start_response('200 OK', list(entry.headers))
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return [b'']
+        return [entry.body]
+
+    def _get(self, path_info):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.pop(path_info, None)
+            if entry is not None:
+                self._entries[path_info] = entry
+
+        if entry is not None:
+            if now - entry.checked < self.check_interval:
+                return entry
+
+            try:
+                st = os.stat(entry.filename)
+            except (IOError, OSError):
+                st = None
+
+            if st is not None and (st.st_mtime, st.st_size) == (entry.mtime, entry.size):
+                entry.checked = now
+                return entry
+
+            self._discard(path_info)
+
+        return self._load(path_info, now)
+
+    def _load(self, path_info, now):
+        filename = os.path.abspath(os.path.join(self.public_path, path_info.lstrip('/')))
+        if not filename.startswith(self.public_path):
+            return None
+
+        try:
+            st = os.stat(filename)
+        except (IOError, OSError):
+            return None
+
+        if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_file_size:
+            return None
+
+        try:
+            with open(filename, 'rb') as f:
+                body = f.read()
+        except (IOError, OSError):
+            return None
+
+        content_type, content_encoding = _guess_type(filename)
+        etag = _file_etag(filename, st)
+        headers = [('Content-Type', content_type or 'application/octet-stream'),
+                   ('Content-Length', str(len(body))),
+                   ('Last-Modified', formatdate(st.st_mtime, usegmt=True)),
+                   ('ETag', etag)]
+        if content_encoding:
+            headers.append(('Content-Encoding', content_encoding))
+
+        entry = CachedStaticFile(filename, body, tuple(headers), st.st_mtime, st.st_size,
+                                 etag, now)
+        with self._lock:
+            previous = self._entries.pop(path_info, None)
+            if previous is not None:
+                self.size -= len(previous.body)
+
+            self._entries[path_info] = entry
+            self.size += len(body)
+            while self.size > self.max_size and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+        return entry
+
+    def _discard(self, path_info):
+        with self._lock:
+            entry = self._entries.pop(path_info, None)
+            if entry is not None:
+                self.size -= len(entry.body)
+
+
+class StreamingStatics(object):
+    """Serves static files streaming them and supporting ``Range`` requests.
+
+    Whole files and ranges up to the end of the file are sent through
+    ``wsgi.file_wrapper`` when the server provides it, so that servers
+    supporting it can rely on ``sendfile`` to send them.
+    Both single and multiple ranges are supported, multiple ranges are
+    sent as a ``multipart/byteranges`` response. Conditional requests are
+    answered with ``304 Not Modified`` and ``If-Range`` is honoured
+    when it matches the ``ETag`` or the ``Last-Modified`` of the file.
+
+    Anything that is not a regular file, like directories, is served
+    by the wrapped ``app``.
+    """
+    def __init__(self, app, public_path, block_size=1 << 16):
+        self.app = app
+        self.public_path = os.path.join(os.path.abspath(public_path), '')
+        self.block_size = block_size
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+
+        filename = os.path.abspath(os.path.join(self.public_path,
+                                                environ.get('PATH_INFO', '').lstrip('/')))
+        if not filename.startswith(self.public_path):
+            return self.app(environ, start_response)
+
+        try:
+            f = open(filename, 'rb')
+        except (IOError, OSError):
+            return self.app(environ, start_response)
+
+        try:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                f.close()
+                return self.app(environ, start_response)
+            return self._serve(f, filename, st, environ, start_response)
+        except:
+            f.close()
+            raise
+
+    def _serve(self, f, filename, st, environ, start_response):
+        size = st.st_size
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        etag = _file_etag(filename, st)
+
+        if _not_modified(environ, etag, st.st_mtime):
+            f.close()
+            start_response('304 Not Modified', [('ETag', etag), ('Last-Modified', last_modified)])
+            return []
+
+        content_type, content_encoding = _guess_type(filename)
+        content_type = content_type or 'application/octet-stream'
+
+        headers = [('Last-Modified', last_modified), ('ETag', etag), ('Accept-Ranges', 'bytes')]
+        if content_encoding:
+            headers.append(('Content-Encoding', content_encoding))
+
+        ranges = None
+        if 'HTTP_RANGE' in environ and _if_range_matches(environ, etag, st.st_mtime):
+            ranges = _parse_ranges(environ['HTTP_RANGE'], size)
+
+        if ranges == []:
+            f.close()
+            headers.append(('Content-Range', 'bytes */%d' % size))
+            headers.append(('Content-Length', '0'))
+            start_response('416 Requested Range Not Satisfiable', headers)
+            return []
+
+        if ranges is None:
+            status = '200 OK'
+            headers.append(('Content-Type', content_type))
+            headers.append(('Content-Length', str(size)))
+            ranges = [(0, size - 1)]
+            parts = None
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            status = '206 Partial Content'
+            headers.append(('Content-Type', content_type))
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end, size)))
+            headers.append(('Content-Length', str(end - start + 1)))
+            parts = None
+        else:
+            boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+            parts = []
+            length = 0
+            for start, end in ranges:
+                part_header = ('--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+                    boundary, content_type, start, end, size
+                )).encode('ascii')
+                parts.append(part_header)
+                length += len(part_header) + (end - start + 1) + 2
+            parts.append(('--%s--\r\n' % boundary).encode('ascii'))
+            length += len(parts[-1])
+
+            status = '206 Partial Content'
+            headers.append(('Content-Type', 'multipart/byteranges; boundary=%s' % boundary))
+            headers.append(('Content-Length', str(length)))
+
+        start_response(status, headers)
+
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            f.close()
+            return []
+
+        start, end = ranges[0]
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if parts is None and file_wrapper is not None and end == size - 1:
+            # Servers must not send more than Content-Length, but some
+            # don't enforce it, so file_wrapper is only used up to EOF.
+            f.seek(start)
+            return file_wrapper(f, self.block_size)
+
+        return _FileRangesIter(f, ranges, parts, self.block_size)
+
+
+class _FileRangesIter(object):
+    def __init__(self, f, ranges, parts, block_size):
+        self.file = f
+        self.ranges = ranges
+        self.parts = parts
+        self.block_size = block_size
+
+    def __iter__(self):
+        for idx, (start, end) in enumerate(self.ranges):
+            if self.parts is not None:
+                yield self.parts[idx]
+
+            self.file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = self.file.read(min(self.block_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+            if self.parts is not None:
+                yield b'\r\n'
+
+        if self.parts is not None:
+            yield self.parts[-1]
+
+    def close(self):
+        self.file.close()
+
+
+def _if_range_matches(environ, etag, mtime):
+    """Whenever the ``Range`` should be honoured according to ``If-Range``.
+
+    ``If-Range`` can provide a strong entity tag or the exact
+    modification date of the representation the client already has.
+    """
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+
+    parsed = parsedate_tz(if_range)
+    return parsed is not None and mktime_tz(parsed) == int(mtime)
+
+
+def _parse_ranges(header, size, max_ranges=MAX_RANGES):
+    """Parses a Range header into a list of ``(start, end)`` inclusive offsets.
+
+    Overlapping and adjacent ranges are merged and returned sorted.
+    Returns ``None`` when the header is not valid and should be ignored
+    and an empty list when none of the ranges can be satisfied.
+    To prevent responses much bigger than the file, the header is also
+    ignored when it asks for more than ``max_ranges`` ranges or for
+    more bytes than the file size.
+    """
+    units, _, ranges_spec = header.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+
+    specs = [spec.strip() for spec in ranges_spec.split(',') if spec.strip()]
+    if len(specs) > max_ranges:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.partition('-')
+        if not sep:
+            return None
+
+        try:
+            if not start:
+                suffix = int(end)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(start)
+                end = int(end) if end else size - 1
+        except ValueError:
+            return None
+
+        if start >= size:
+            continue
+        if start > end:
+            return None
+        ranges.append((start, min(end, size - 1)))
+
+    if sum(end - start + 1 for start, end in ranges) > size:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
 
 class StaticsAdapter(object):
     def __init__(self, app_config, module, options):
@@ -40,8 +879,31 @@ class StaticsAdapter(object):
         if plugged['modules'][module_name]['statics'] is None:
             statics_app = DirectoryApp(self.public_path)
 
+            if self.options.get('statics_streaming', False):
+                statics_app = StreamingStatics(statics_app, self.public_path)
+
+            manifest = None
+            if self.options.get('statics_manifest', False):
+                manifest = StaticsManifest(self.public_path)
+
+            cache_size = self.options.get('statics_cache_size')
+            if cache_size:
+                statics_app = StaticsCache(
+                    statics_app, self.public_path, cache_size,
+                    max_file_size=self.options.get('statics_cache_max_file_size', 128*1024),
+                    check_interval=self.options.get('statics_cache_check_interval', 2)
+                )
+
+            if self.options.get('statics_precompressed', False):
+                statics_app = PrecompressedStatics(statics_app, self.public_path, manifest)
+
             static_middlewares = self.options.get('static_middlewares', [])
             for middleware in static_middlewares:
                 statics_app = middleware(statics_app, self.public_path)
 
+            # Offloaded statics are protected by the same middlewares
+            plugged['modules'][module_name]['statics_middlewares'] = static_middlewares
+            plugged['modules'][module_name]['statics_manifest'] = manifest
+            plugged['modules'][module_name]['statics_path'] = self.public_path
             plugged['modules'][module_name]['statics'] = statics_app
+            plugged['statics_revision'] += 1
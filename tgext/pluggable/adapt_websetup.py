@@ -35,11 +35,13 @@ class PluggedBootstrap(object):
 
 
 class WebSetupAdapter(object):
-    def __init__(self, config, module, options):
+    def __init__(self, config, module, options, plugin_bootstrap=None):
         self.config = config
         self.models = module.model
         self.options = options
-        self.plugin_bootstrap = module.bootstrap.bootstrap
+        if plugin_bootstrap is None:
+            plugin_bootstrap = module.bootstrap.bootstrap
+        self.plugin_bootstrap = plugin_bootstrap
         self.module_name = module.__name__
 
     def adapt_bootstrap(self):
@@ -0,0 +1,411 @@
+import os
+import sqlite3
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+import tg
+from markupsafe import Markup
+
+
+def cached_partial(expire=None, depends_on=None):
+    """Enables caching of the rendered output of a partial.
+
+    The output is cached by :func:`.call_partial` for each combination
+    of partial path and parameters, for ``expire`` seconds or until
+    it gets evicted from the cache when ``expire`` is ``None``.
+
+    ``depends_on`` can be a list of SQLAlchemy models or table names,
+    the cached output is discarded whenever a transaction that changed
+    any of them gets committed. Callables returning a model are also
+    accepted for models that are not available at import time.
+
+    Can be applied to partials that are functions or controller methods::
+
+        @cached_partial(expire=300)
+        @expose('plugappname.templates.little_partial')
+        def something(name):
+            return dict(name=name)
+
+    Keep in mind that the output is shared by all the requests for the
+    same languages, so partials that depend on the current user
+    should not be cached.
+    """
+    def _cached_partial(func):
+        getattr(func, '__func__', func)._tgext_pluggable_cache = dict(expire=expire,
+                                                                      depends_on=depends_on or ())
+        return func
+    return _cached_partial
+
+
+def partial_cache_options(func):
+    """Caching options of a partial, ``None`` when the partial is not cached."""
+    return getattr(func, '_tgext_pluggable_cache', None)
+
+
+def dependencies_tags(depends_on):
+    """Tags identifying the tables a cached partial depends on."""
+    tags = set()
+    for dependency in depends_on:
+        if callable(dependency) and not isinstance(dependency, type):
+            dependency = dependency()
+
+        if isinstance(dependency, str):
+            tags.add(dependency)
+        elif hasattr(dependency, '__table__'):
+            tags.add(dependency.__table__.name)
+        else:
+            tags.add(dependency.__tablename__)
+    return frozenset(tags)
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _canonical(value):
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((_canonical(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return ('set', tuple(sorted(_canonical(v) for v in value)))
+    raise _Uncacheable(value)
+
+
+def partial_cache_key(path, params, langs=()):
+    """Key identifying the output of partial ``path`` called with ``params``.
+
+    ``langs`` are the languages of the request, as partials
+    might translate their output.
+    Returns ``None`` when any of the parameters is not a primitive
+    type or a container of them, as those cannot be reliably compared.
+    """
+    try:
+        return repr((path, tuple(langs), _canonical(params)))
+    except (_Uncacheable, TypeError):
+        return None
+
+
+class PartialsCacheBackend(object):
+    """Storage of the rendered output of partials.
+
+    Backends store the output associated to a key, optionally with an
+    expiration time in seconds and a list of tags. All the outputs
+    associated to a tag can be removed by invalidating the tag.
+    A custom backend can be used by setting an instance of it
+    as the ``tgext.pluggable.partials_cache_backend`` option.
+    """
+    def get(self, key):
+        """The output stored for ``key`` or ``None``"""
+        raise NotImplementedError()
+
+    def set(self, key, value, expire=None, tags=()):
+        raise NotImplementedError()
+
+    def invalidate(self, tags):
+        """Discards all the outputs associated to any of ``tags``"""
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class MemoryCacheBackend(PartialsCacheBackend):
+    """Keeps up to ``max_entries`` outputs in memory evicting the least recently used."""
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry[0] is not None and entry[0] <= now:
+                self._discard(key)
+                return None
+
+            self._entries.pop(key)
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value, expire=None, tags=()):
+        expires_at = time.time() + expire if expire else None
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (expires_at, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(PartialsCacheBackend):
+    """Stores outputs in a SQLite database shared by all the processes of the host.
+
+    The database is used in WAL mode, so that readers don't block
+    each other. When the stored outputs exceed ``max_size`` bytes the
+    least recently used ones are removed, the last access of an output
+    is recorded at most once every ``ACCESS_RESOLUTION`` seconds.
+    Only text outputs can be stored, other values are not cached.
+    """
+    SCHEMA_VERSION = 2
+    SCHEMA = (
+        'CREATE TABLE entries (key TEXT PRIMARY KEY, value TEXT, markup INTEGER, '
+        'expires REAL, size INTEGER, accessed REAL)',
+        'CREATE INDEX entries_accessed ON entries (accessed)',
+        'CREATE TABLE tags (tag TEXT, key TEXT)',
+        'CREATE INDEX tags_tag ON tags (tag)',
+        'CREATE INDEX tags_key ON tags (key)',
+        # Size of the stored outputs, so that it can be checked on every set
+        'CREATE TABLE stats (total_size INTEGER)',
+        'INSERT INTO stats VALUES (0)',
+        'CREATE TRIGGER entries_insert AFTER INSERT ON entries '
+        'BEGIN UPDATE stats SET total_size = total_size + NEW.size; END',
+        'CREATE TRIGGER entries_delete AFTER DELETE ON entries '
+        'BEGIN UPDATE stats SET total_size = total_size - OLD.size; END',
+    )
+    ACCESS_RESOLUTION = 1
+
+    def __init__(self, filename, max_size=64*1024*1024, timeout=5):
+        self.filename = filename
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self._local = threading.local()
+
+    def _check_permissions(self):
+        # Cached outputs can be restored as Markup, so the database must
+        # not be writable by anyone else than the application user.
+        # It is created readable only by the user and checked once opened.
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        try:
+            st = os.fstat(fd)
+        finally:
+            os.close(fd)
+        if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+            raise ValueError('Partials cache %s is owned by another user' % self.filename)
+        if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError('Partials cache %s is writable by other users' % self.filename)
+
+    def _connection(self):
+        # Connections can't be shared across threads or forked processes
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            self._check_permissions()
+            conn = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._create_schema(conn)
+            self._local.conn, self._local.pid = conn, pid
+        return conn
+
+    def _create_schema(self, conn):
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('PRAGMA user_version').fetchone()[0] == self.SCHEMA_VERSION:
+                return
+
+            # Databases of previous versions only contain cached outputs
+            for table in ('entries', 'tags', 'stats'):
+                conn.execute('DROP TABLE IF EXISTS %s' % table)
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT value, markup, expires, accessed FROM entries WHERE key = ?', (key, )
+        ).fetchone()
+        if row is None:
+            return None
+
+        value, markup, expires, accessed = row
+        now = time.time()
+        if expires is not None and expires <= now:
+            return None
+        if accessed < now - self.ACCESS_RESOLUTION:
+            with conn:
+                conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return Markup(value) if markup else value
+
+    def set(self, key, value, expire=None, tags=()):
+        if not isinstance(value, str):
+            return
+
+        now = time.time()
+        expires_at = now + expire if expire else None
+        markup = hasattr(value, '__html__')
+        value = str(value)
+        size = len(value.encode('utf-8'))
+        if size > self.max_size:
+            return
+
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM entries WHERE key = ?', (key, ))
+            conn.execute('DELETE FROM tags WHERE key = ?', (key, ))
+            conn.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, value, markup, expires_at, size, now))
+            conn.executemany('INSERT INTO tags VALUES (?, ?)', [(tag, key) for tag in tags])
+            self._evict(conn, now)
+
+    def evict(self):
+        """Removes expired outputs and the least recently used ones when exceeding ``max_size``"""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM entries WHERE expires <= ?', (time.time(), ))
+            self._evict(conn, time.time())
+            conn.execute('DELETE FROM tags WHERE key NOT IN (SELECT key FROM entries)')
+
+    def _evict(self, conn, now):
+        total_size = conn.execute('SELECT total_size FROM stats').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        conn.execute('DELETE FROM entries WHERE expires <= ?', (now, ))
+        excess = conn.execute('SELECT total_size FROM stats').fetchone()[0] - self.max_size
+        removed = 0
+        keys = []
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            if removed >= excess:
+                break
+            keys.append((key, ))
+            removed += size
+        conn.executemany('DELETE FROM entries WHERE key = ?', keys)
+        conn.executemany('DELETE FROM tags WHERE key = ?', keys)
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+
+        placeholders = ', '.join('?' * len(tags))
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM entries WHERE key IN '
+                         '(SELECT key FROM tags WHERE tag IN (%s))' % placeholders, tags)
+            conn.execute('DELETE FROM tags WHERE tag IN (%s)' % placeholders, tags)
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM tags')
+
+
+class PartialsCache(object):
+    """Cache of the rendered output of partials.
+
+    Stores the outputs in a :class:`PartialsCacheBackend` and tracks hits
+    and misses both globally and for each partial through the ``hits``,
+    ``misses`` and ``stats`` attributes. Statistics are kept by each process.
+
+    Outputs can be associated to tags, all the outputs associated
+    to a tag are discarded when the tag is invalidated.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.stats = {}
+
+        self._lock = threading.Lock()
+
+    def get(self, path, key):
+        value = self.backend.get(key)
+        with self._lock:
+            stats = self.stats.setdefault(path, [0, 0])
+            if value is None:
+                self.misses += 1
+                stats[1] += 1
+            else:
+                self.hits += 1
+                stats[0] += 1
+        return value
+
+    def set(self, key, value, expire=None, tags=()):
+        self.backend.set(key, value, expire, tags)
+
+    def invalidate(self, tags):
+        """Discards all the outputs associated to any of ``tags``"""
+        self.backend.invalidate(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def _create_backend(config):
+    backend = config.get('tgext.pluggable.partials_cache_backend', 'memory')
+    if backend == 'memory':
+        return MemoryCacheBackend(int(config.get('tgext.pluggable.partials_cache_size', 1024)))
+    elif backend == 'sqlite':
+        filename = config.get('tgext.pluggable.partials_cache_file')
+        if not filename:
+            raise ValueError('tgext.pluggable.partials_cache_file is required by the sqlite '
+                             'partials cache backend')
+        max_size = int(config.get('tgext.pluggable.partials_cache_max_size', 64*1024*1024))
+        return SQLiteCacheBackend(filename, max_size)
+    elif isinstance(backend, str):
+        raise ValueError('Unsupported partials cache backend: %s' % backend)
+    return backend
+
+
+_PARTIALS_CACHE_LOCK = threading.Lock()
+
+
+def partials_cache(config=None):
+    """Cache of the partials output of the current application"""
+    if config is None:
+        config = tg.config._current_obj()
+
+    cache = config.get('tgext.pluggable.partials_output_cache')
+    if cache is None:
+        with _PARTIALS_CACHE_LOCK:
+            # Concurrent requests must not create different backends
+            cache = config.get('tgext.pluggable.partials_output_cache')
+            if cache is None:
+                cache = config['tgext.pluggable.partials_output_cache'] = PartialsCache(_create_backend(config))
+    return cache
@@ -0,0 +1 @@
+from .command import CollectStaticsCommand
\ No newline at end of file
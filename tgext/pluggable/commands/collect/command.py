@@ -0,0 +1,183 @@
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import argparse
+
+import tg
+from gearbox.command import Command
+from paste.deploy import loadapp
+
+from tgext.pluggable import plugged
+from tgext.pluggable.adapt_statics import (StaticsManifest, precompress_file, STATICS_PREFIX,
+                                          PRECOMPRESSED_ENCODINGS, PRECOMPRESSED_TYPES)
+
+
+class CollectStaticsCommand(Command):
+    """Collect the static files of plugged applications in a single directory.
+
+Loads the application to detect the plugged apps and copies the static
+files of each one of them inside the output directory, using the same
+``_pluggable/PLUGNAME`` layout used by the application to serve them::
+
+    $ gearbox collect-pluggable-statics -c production.ini -o /var/www/statics
+
+Compressed variants of the files are created and a ``manifest.json`` file
+listing size, hash and compressed variants of each file is written inside
+the ``_pluggable`` directory. Files collected by previous runs that are no
+longer provided by the plugged apps are reported, or removed with ``--clean``. The output directory can then be served by
+a web server or uploaded to a CDN, setting ``tgext.pluggable.serve_statics = false``
+in the configuration file disables serving them from the application.
+"""
+
+    def get_description(self):
+        return self.__doc__
+
+    def get_parser(self, prog_name):
+        parser = super(CollectStaticsCommand, self).get_parser(prog_name)
+        parser.formatter_class = argparse.RawDescriptionHelpFormatter
+
+        parser.add_argument("-c", "--config",
+                            help='application config file to read (default: development.ini)',
+                            dest='config', default="development.ini")
+
+        parser.add_argument("-o", "--output", required=True, dest='output',
+                            help='directory where to collect the static files')
+
+        parser.add_argument("--link", action='store_true', dest='link',
+                            help='hardlink files instead of copying them when possible')
+
+        parser.add_argument("--no-compress", action='store_false', dest='compress',
+                            help='do not create compressed variants of the static files')
+
+        parser.add_argument("--min-size", type=int, default=512, dest='min_size',
+                            help='files smaller than this amount of bytes are not compressed')
+
+        parser.add_argument("--clean", action='store_true', dest='clean',
+                            help='remove previously collected files that are no longer provided')
+
+        return parser
+
+    def take_action(self, opts):
+        loadapp('config:%s' % opts.config, relative_to=os.getcwd())
+        modules = tg.config['tgext.pluggable.plugged']['modules']
+
+        statics_root = os.path.join(os.path.abspath(opts.output), STATICS_PREFIX.strip('/'))
+        manifest = {}
+        collected_files = set()
+        for pluggable in sorted(plugged()):
+            module = modules[pluggable]['module']
+            if not hasattr(module, 'public'):
+                continue
+
+            public_path = os.path.dirname(module.public.__file__)
+            target_path = os.path.join(statics_root, pluggable)
+            print('\n%s Statics' % pluggable)
+            print("\tDirectory '%s'" % public_path)
+            print("\tCollected in '%s'" % target_path)
+
+            collected = self._collect(public_path, target_path, opts)
+            print('\t%d files collected' % len(collected))
+            collected_files.update(collected)
+
+            manifest[pluggable] = self._manifest(target_path)
+
+        manifest_path = os.path.join(statics_root, 'manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        print("\nManifest written to '%s'" % manifest_path)
+
+        stale_files = self._stale_files(statics_root, collected_files | set([manifest_path]))
+        if stale_files and opts.clean:
+            self._remove(statics_root, stale_files)
+            print('\n%d stale files removed' % len(stale_files))
+        elif stale_files:
+            print('\n%d stale files, not provided by the plugged apps anymore, '
+                  'use --clean to remove them:' % len(stale_files))
+            for stale_file in stale_files:
+                print('\t%s' % stale_file)
+
+    def _collect(self, public_path, target_path, opts):
+        """Copies the files of ``public_path`` and returns the collected paths"""
+        collected = set()
+        for base, dirs, files in os.walk(public_path):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+
+            target_base = os.path.join(target_path, os.path.relpath(base, public_path))
+            if not os.path.isdir(target_base):
+                os.makedirs(target_base)
+
+            for filename in files:
+                if filename.endswith(('.py', '.pyc', '.pyo')):
+                    continue
+
+                source = os.path.join(base, filename)
+                target = os.path.join(target_base, filename)
+                self._copy(source, target, opts.link)
+                collected.add(target)
+
+                if opts.compress and filename.endswith(PRECOMPRESSED_TYPES):
+                    precompress_file(target, opts.min_size)
+                    if os.stat(target).st_size >= opts.min_size:
+                        # Variants created now or by previous runs
+                        collected.update(target + extension for _, extension in PRECOMPRESSED_ENCODINGS
+                                         if os.path.exists(target + extension))
+
+        return collected
+
+    def _stale_files(self, statics_root, collected):
+        stale_files = []
+        for base, dirs, files in os.walk(statics_root):
+            for filename in files:
+                path = os.path.join(base, filename)
+                if path not in collected:
+                    stale_files.append(path)
+        return sorted(stale_files)
+
+    def _remove(self, statics_root, stale_files):
+        for stale_file in stale_files:
+            os.unlink(stale_file)
+
+        # Directories left empty, like those of unplugged apps
+        for base, dirs, files in os.walk(statics_root, topdown=False):
+            if base != statics_root and not os.listdir(base):
+                os.rmdir(base)
+
+    def _copy(self, source, target, link):
+        if os.path.exists(target):
+            os.unlink(target)
+
+        if link:
+            try:
+                os.link(source, target)
+                return
+            except (OSError, AttributeError):
+                # Different filesystems or platform not supporting links
+                pass
+
+        shutil.copy2(source, target)
+
+    def _manifest(self, target_path):
+        files = StaticsManifest(target_path).files
+
+        variants = {}
+        for path in files:
+            for encoding, extension in PRECOMPRESSED_ENCODINGS:
+                if path.endswith(extension) and path[:-len(extension)] in files:
+                    variants[path] = (path[:-len(extension)], encoding)
+
+        manifest = {}
+        for path, file_info in files.items():
+            if path in variants:
+                continue
+            manifest[path] = dict(size=file_info.size, mtime=file_info.mtime,
+                                  sha1=file_info.digest, fingerprint=file_info.fingerprint,
+                                  encodings={})
+
+        for path, (original, encoding) in variants.items():
+            file_info = files[path]
+            manifest[original]['encodings'][encoding] = dict(path=path, size=file_info.size,
+                                                             sha1=file_info.digest)
+
+        return manifest
@@ -0,0 +1 @@
+from .command import PrecompressStaticsCommand
\ No newline at end of file
@@ -0,0 +1,74 @@
+from __future__ import print_function
+
+import os
+import argparse
+
+import tg
+from gearbox.command import Command
+from paste.deploy import loadapp
+
+from tgext.pluggable import plugged
+from tgext.pluggable.adapt_statics import precompress_file, PRECOMPRESSED_TYPES, brotli
+
+
+class PrecompressStaticsCommand(Command):
+    """Precompress the static files of plugged applications.
+
+Loads the application to detect the plugged apps and writes
+a gzip (and brotli when the brotli module is available) compressed
+variant of the static files provided by each one of them::
+
+    $ gearbox precompress-pluggable-statics
+
+The compressed variants are served when the pluggable is plugged
+with the ``statics_precompressed=True`` option.
+"""
+
+    def get_description(self):
+        return self.__doc__
+
+    def get_parser(self, prog_name):
+        parser = super(PrecompressStaticsCommand, self).get_parser(prog_name)
+        parser.formatter_class = argparse.RawDescriptionHelpFormatter
+
+        parser.add_argument("-c", "--config",
+                            help='application config file to read (default: development.ini)',
+                            dest='config', default="development.ini")
+
+        parser.add_argument("--min-size", type=int, default=512, dest='min_size',
+                            help='files smaller than this amount of bytes are not compressed')
+
+        parser.add_argument('pluggables', nargs='*', metavar='PLUGNAME',
+                            help='pluggables to precompress, all of them when omitted')
+
+        return parser
+
+    def take_action(self, opts):
+        loadapp('config:%s' % opts.config, relative_to=os.getcwd())
+        modules = tg.config['tgext.pluggable.plugged']['modules']
+
+        if brotli is None:
+            print('brotli module not available, only gzip variants will be created')
+
+        for pluggable in opts.pluggables or sorted(plugged()):
+            module = modules.get(pluggable, {}).get('module')
+            if module is None:
+                print('%s - pluggable not plugged' % pluggable)
+                continue
+
+            if not hasattr(module, 'public'):
+                print('%s - pluggable provides no statics' % pluggable)
+                continue
+
+            public_path = os.path.dirname(module.public.__file__)
+            print('\n%s Statics' % pluggable)
+            print("\tDirectory '%s'" % public_path)
+
+            written = 0
+            for base, _dirs, files in os.walk(public_path):
+                for filename in files:
+                    if not filename.endswith(PRECOMPRESSED_TYPES):
+                        continue
+                    written += len(precompress_file(os.path.join(base, filename), opts.min_size))
+
+            print('\t%d compressed files written' % written)
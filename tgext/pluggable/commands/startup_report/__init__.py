@@ -0,0 +1 @@
+from .command import StartupReportCommand
\ No newline at end of file
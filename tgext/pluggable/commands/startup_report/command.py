@@ -0,0 +1,86 @@
+from __future__ import print_function
+
+import os
+import argparse
+
+import tg
+from gearbox.command import Command
+from paste.deploy import loadapp
+
+from tgext.pluggable.startup import tracemalloc
+
+
+class StartupReportCommand(Command):
+    """Report the time and memory spent by each plugged application at startup.
+
+Loads the application and prints a table with the wall time and the memory
+growth caused by each pluggable, sorted by the most expensive one::
+
+    $ gearbox pluggable-startup-report -c production.ini
+
+Memory allocated by Python is only reported when ``--tracemalloc`` is
+provided, as tracing allocations slows down the application loading.
+The growth of the resident memory of the process is reported when it
+can be detected on the current platform.
+"""
+
+    def get_description(self):
+        return self.__doc__
+
+    def get_parser(self, prog_name):
+        parser = super(StartupReportCommand, self).get_parser(prog_name)
+        parser.formatter_class = argparse.RawDescriptionHelpFormatter
+
+        parser.add_argument("-c", "--config",
+                            help='application config file to read (default: development.ini)',
+                            dest='config', default="development.ini")
+
+        parser.add_argument("-s", "--sort", dest='sort_by', default='duration',
+                            choices=('duration', 'memory', 'rss', 'name'),
+                            help='column the pluggables are sorted by (default: duration)')
+
+        parser.add_argument("--phases", action='store_true', dest='phases',
+                            help='report each phase of the pluggables startup')
+
+        parser.add_argument("--tracemalloc", action='store_true', dest='tracemalloc',
+                            help='trace memory allocated by Python while loading the application')
+
+        return parser
+
+    def take_action(self, opts):
+        if opts.tracemalloc:
+            if tracemalloc is None:
+                print('tracemalloc is not available, Python memory will not be reported')
+            else:
+                tracemalloc.start()
+
+        loadapp('config:%s' % opts.config, relative_to=os.getcwd())
+        if opts.tracemalloc and tracemalloc is not None:
+            tracemalloc.stop()
+
+        report = tg.config['tgext.pluggable.plugged'].startup_report(opts.sort_by)
+        if not report:
+            print('No pluggable applications plugged')
+            return
+
+        rows = []
+        for entry in report:
+            rows.append((entry['pluggable'], entry['total']))
+            if opts.phases:
+                for phase in entry['phases']:
+                    rows.append(('  ' + phase.name, phase))
+
+        table = [('PLUGGABLE', 'TIME (ms)', 'MEMORY (KiB)', 'RSS (KiB)')]
+        for name, stats in rows:
+            table.append((name, '%.1f' % (stats.duration * 1000),
+                          self._kib(stats.memory), self._kib(stats.rss)))
+
+        widths = [max(len(row[idx]) for row in table) for idx in range(4)]
+        for row in table:
+            print('  '.join([row[0].ljust(widths[0])] +
+                            [value.rjust(width) for value, width in zip(row[1:], widths[1:])]))
+
+    def _kib(self, size):
+        if size is None:
+            return '-'
+        return '%.1f' % (size / 1024.0)
@@ -0,0 +1,147 @@
+import hmac
+import json
+import logging
+import time
+from hashlib import sha256
+
+import tg
+from tg import expose, TGController
+from tg.exceptions import HTTPForbidden, HTTPBadRequest
+from markupsafe import Markup, escape
+
+from .adapt_controllers import ControllersAdapter
+from .utils import call_partial
+
+MOUNTPOINT = '_pluggable_partials'
+
+# Deferred partials urls are signed with a key derived from the secret,
+# so that the signatures can't be reused where the secret is used.
+SIGNING_LABEL = b'tgext.pluggable.deferred_partials'
+
+# Seconds deferred partials urls are valid for, unless configured
+DEFAULT_EXPIRE = 24 * 3600
+
+# Replaces the placeholders with the partials they refer to
+LOADER_SCRIPT = '''(function() {
+  function load() {
+    var nodes = document.querySelectorAll('[data-pluggable-partial]');
+    Array.prototype.forEach.call(nodes, function(node) {
+      var xhr = new XMLHttpRequest();
+      xhr.open('GET', node.getAttribute('data-pluggable-partial'));
+      xhr.onload = function() { if (xhr.status === 200) node.outerHTML = xhr.responseText; };
+      xhr.send();
+    });
+  }
+  if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', load);
+  else load();
+})();'''
+
+log = logging.getLogger('tgext.pluggable')
+
+
+def defer_partial(path, **params):
+    """Placeholder for a partial that will be rendered by a separate request.
+
+    Depending on the ``tgext.pluggable.deferred_partials`` option the
+    placeholder is an ``<esi:include>`` tag (``esi``) meant to be resolved
+    by a caching proxy, or a ``<div data-pluggable-partial="URL">`` element
+    (``placeholder``) that is filled by the script of
+    :func:`deferred_partials_loader`. When the option is not set the
+    partial is rendered inline like :func:`.call_partial` would.
+
+    The url of the partial is signed, so only partials and parameters
+    generated by the application can be rendered through it, and expires
+    after ``tgext.pluggable.deferred_partials_expire`` seconds (one day by default).
+    Partials whose parameters can't be serialized to JSON are rendered inline.
+    """
+    config = tg.config._current_obj()
+    mode = config.get('tgext.pluggable.deferred_partials')
+    if not mode:
+        return call_partial(path, **params)
+
+    try:
+        url = deferred_partial_url(path, params, config)
+    except TypeError:
+        log.warning('Parameters of %s are not serializable to JSON, rendering it inline', path)
+        return call_partial(path, **params)
+    if mode == 'esi':
+        return Markup('<esi:include src="%s"/>' % url)
+    elif mode == 'placeholder':
+        return Markup('<div data-pluggable-partial="%s"></div>' % escape(url))
+    raise ValueError('Unsupported deferred partials mode: %s' % mode)
+
+
+def deferred_partials_loader(nonce=None):
+    """Script that renders the ``placeholder`` deferred partials of the page.
+
+    Must be placed in the page after the placeholders or in its ``head``,
+    each placeholder is replaced by the output of its partial once fetched.
+    Scripts contained in the partials are not executed. A ``nonce`` can be
+    provided for pages served with a Content Security Policy.
+    """
+    nonce = ' nonce="%s"' % escape(nonce) if nonce else ''
+    return Markup('<script%s>%s</script>' % (nonce, LOADER_SCRIPT))
+
+
+def deferred_partial_url(path, params, config=None):
+    if config is None:
+        config = tg.config._current_obj()
+
+    encoded_params = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    expires = str(int(time.time() + int(config.get('tgext.pluggable.deferred_partials_expire',
+                                                   DEFAULT_EXPIRE))))
+    return tg.url('/%s/' % MOUNTPOINT, params=dict(partial=path,
+                                                   params=encoded_params,
+                                                   expires=expires,
+                                                   signature=_sign(config, path, encoded_params,
+                                                                   expires)))
+
+
+def _signing_key(config):
+    secret = (config.get('tgext.pluggable.partials_secret') or
+              config.get('session.secret') or
+              config.get('beaker.session.secret') or
+              config.get('cookie_secret'))
+    if not secret:
+        raise ValueError('Deferred partials require a tgext.pluggable.partials_secret option')
+
+    return hmac.new(secret.encode('utf-8'), SIGNING_LABEL, sha256).digest()
+
+
+def _sign(config, path, encoded_params, expires):
+    message = ('%s\0%s\0%s' % (path, encoded_params, expires)).encode('utf-8')
+    return hmac.new(_signing_key(config), message, sha256).hexdigest()
+
+
+class DeferredPartialsController(TGController):
+    """Renders a single partial from a signed url generated by :func:`defer_partial`"""
+    @expose()
+    def index(self, partial=None, params='{}', expires='', signature='', **kw):
+        if partial is None:
+            raise HTTPBadRequest()
+
+        expected = _sign(tg.config._current_obj(), partial, params, expires)
+        if not hmac.compare_digest(expected, str(signature)):
+            raise HTTPForbidden()
+
+        if int(expires) < time.time():
+            raise HTTPForbidden('Deferred partial url expired')
+
+        return call_partial(partial, **json.loads(params))
+
+
+class DeferredPartialsAdapter(ControllersAdapter):
+    """Mounts the :class:`DeferredPartialsController` when deferred partials are enabled"""
+    def __init__(self, config):
+        super(DeferredPartialsAdapter, self).__init__(config, None, dict(appid=MOUNTPOINT))
+
+    def mount_controllers(self, app):
+        if not tg.config.get('tgext.pluggable.deferred_partials'):
+            return app
+
+        # Refuse to start when partials urls can't be signed
+        _signing_key(tg.config)
+
+        mountpoint, name = self._resolve_mountpoint(MOUNTPOINT)
+        setattr(mountpoint, name, DeferredPartialsController())
+        return app
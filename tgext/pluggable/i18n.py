@@ -1,11 +1,24 @@
 import gettext as _gettext
 
+import copy
 import os
-from tg import translator, config
+import threading
+from collections import OrderedDict
+from tg import translator, config, request_local
 from tg.i18n import LanguageError
+try:
+    from tg.i18n import _TGI18NIdentityTranslator
+except ImportError:  # pragma: no cover
+    # Without it application translators are never merged, pluggables are chained instead
+    _TGI18NIdentityTranslator = ()
 
 from .utils import plugged
 
+TRANSLATORS_CACHE_SIZE = 256
+_TRANSLATORS_CACHE = OrderedDict()
+_TRANSLATORS_CACHE_LOCK = threading.Lock()
+_CATALOGS_CACHE_LOCK = threading.Lock()
+
 
 def pluggable_translations_wrapper(*args):
     if len(args) > 1:
@@ -26,18 +39,229 @@ def pluggable_translations_wrapper(*args):
 
 def _add_pluggables_translators():
     app_translator = translator._current_obj()
+    if getattr(app_translator, '_pluggable_fallbacks', False):
+        # Translators of pluggables were already chained to this request translator
+        return
+
+    # Catalogs of the pluggables are only resolved when a message is
+    # not translated by the application, so requests that never translate
+    # anything provided by a pluggable don't pay for them.
+    tgl = request_local.context._current_obj()
+    tgl.translator = MergedTranslations(app_translator)
+
+
+def _chain_pluggables_translators(app_translator, langs):
     for pluggable in plugged():
-        app_translator.add_fallback(_translator_for_pluggable(app_translator, pluggable))
+        # Cached translators are shared across requests, so their fallback
+        # chain is copied before being appended to the request translator.
+        app_translator.add_fallback(_copy_chain(_cached_translator(pluggable, langs)))
+    app_translator._pluggable_fallbacks = True
+
+
+class MergedTranslations(_gettext.NullTranslations):
+    """Translations of the application and of the pluggables in a single catalog.
+
+    Until a message is missing from the application translations, messages
+    are looked up in the application translator only. At the first miss
+    they start being looked up in the catalog merged by :func:`_merged_catalog`.
+    Plural forms are still resolved by the chain of translators as each
+    language might have different plural rules.
+    """
+    CONTEXT = '%s\x04%s'
+
+    def __init__(self, app_translator):
+        _gettext.NullTranslations.__init__(self)
+        self._app_translator = app_translator
+        self._app_catalogs = _app_catalogs(app_translator)
+        self._langs = tuple(getattr(app_translator, 'tg_lang', []) or [])
+        self._catalog = None
+        self._resolved = False
+        self._info = getattr(app_translator, '_info', {})
+        self._charset = getattr(app_translator, '_charset', None)
+        self.tg_lang = getattr(app_translator, 'tg_lang', None)
+        self.tg_supported_lang = getattr(app_translator, 'tg_supported_lang', None)
+        self._pluggable_fallbacks = True
+        self._with_fallbacks = False
+
+    def _resolve(self):
+        self._resolved = True
+        if self._app_catalogs is None:
+            # Application translator can't be merged, rely on fallbacks.
+            self._chain()
+        else:
+            self._catalog = _merged_catalog(self._langs, *self._app_catalogs)
+        return self._catalog
+
+    def _chain(self):
+        app_translator = self._app_translator
+        if not getattr(app_translator, '_pluggable_fallbacks', False):
+            _chain_pluggables_translators(app_translator, self._langs)
+        return app_translator
+
+    def add_fallback(self, fallback):
+        self._chain().add_fallback(fallback)
+        self._with_fallbacks = True
+
+    def gettext(self, message):
+        catalog = self._catalog
+        if catalog is None:
+            tmsg = self._app_translator.gettext(message)
+            if tmsg != message or self._resolved:
+                return tmsg
+            catalog = self._resolve()
+            if catalog is None:
+                return self._app_translator.gettext(message)
+
+        tmsg = catalog.get(message)
+        if tmsg is not None:
+            return tmsg
+        if self._with_fallbacks:
+            return self._chain().gettext(message)
+        return message
+    ugettext = gettext
+
+    def pgettext(self, context, message):
+        catalog = self._catalog
+        if catalog is None:
+            tmsg = self._app_translator.pgettext(context, message)
+            if tmsg != message or self._resolved:
+                return tmsg
+            catalog = self._resolve()
+            if catalog is None:
+                return self._app_translator.pgettext(context, message)
+
+        tmsg = catalog.get(self.CONTEXT % (context, message))
+        if tmsg is not None:
+            return tmsg
+        if self._with_fallbacks:
+            return self._chain().pgettext(context, message)
+        return message
+
+    def ngettext(self, msgid1, msgid2, n):
+        return self._chain().ngettext(msgid1, msgid2, n)
+
+    def ungettext(self, msgid1, msgid2, n):
+        return self._chain().ungettext(msgid1, msgid2, n)
+
+    def npgettext(self, context, msgid1, msgid2, n):
+        return self._chain().npgettext(context, msgid1, msgid2, n)
+
+
+def _translators_chain(head):
+    while head is not None:
+        yield head
+        head = head._fallback
+
+
+def _merge_catalog(merged, node):
+    catalog = node._catalog
+    singular = node.plural(1)
+    for key, tmsg in catalog.items():
+        if isinstance(key, tuple):
+            # Lookup of a plural message through gettext uses its singular form
+            msgid, idx = key
+            if idx == singular and msgid not in catalog:
+                merged.setdefault(msgid, tmsg)
+        else:
+            merged.setdefault(key, tmsg)
+
+
+def _app_catalogs(app_translator):
+    """Translators of the application that provide a catalog.
+
+    Returns a ``(translators, with_pluggables)`` tuple or ``None``
+    when the application translator cannot be merged.
+    """
+    app_catalogs = []
+    for node in _translators_chain(app_translator):
+        if isinstance(node, _TGI18NIdentityTranslator):
+            # Translations stop at native languages
+            return tuple(app_catalogs), False
+        elif hasattr(node, '_catalog'):
+            app_catalogs.append(node)
+        elif type(node) is not _gettext.NullTranslations:
+            return None
+    return tuple(app_catalogs), True
+
+
+def _merged_catalog(langs, app_catalogs, with_pluggables):
+    """Catalog with the messages of the application and of all the pluggables.
+
+    The precedence of the chain of translators is preserved: messages of the
+    application come first, then those of each pluggable in the order they
+    were plugged.
+    """
+    catalogs_cache = _catalogs_cache()
+    key = (langs, with_pluggables, tuple(id(node._catalog) for node in app_catalogs))
+    with _CATALOGS_CACHE_LOCK:
+        if key in catalogs_cache:
+            cached = catalogs_cache.pop(key)
+            catalogs_cache[key] = cached
+            return cached[1]
+
+    merged = {}
+    for node in app_catalogs:
+        _merge_catalog(merged, node)
+    if with_pluggables:
+        for pluggable in plugged():
+            for node in _translators_chain(_cached_translator(pluggable, langs)):
+                if hasattr(node, '_catalog'):
+                    _merge_catalog(merged, node)
+
+    # Application catalogs are kept referenced so that their id is not reused
+    cached = (tuple(node._catalog for node in app_catalogs), merged)
+    with _CATALOGS_CACHE_LOCK:
+        cached = catalogs_cache.setdefault(key, cached)
+        while len(catalogs_cache) > _cache_size():
+            catalogs_cache.popitem(last=False)
+    return cached[1]
+
+
+def _catalogs_cache():
+    """Merged catalogs of the current application, as each one plugs different pluggables"""
+    conf = config._current_obj()
+    cache = conf.get('tgext.pluggable.catalogs_cache')
+    if cache is None:
+        with _CATALOGS_CACHE_LOCK:
+            cache = conf.setdefault('tgext.pluggable.catalogs_cache', OrderedDict())
+    return cache
+
+
+def _cache_size():
+    return int(config.get('tgext.pluggable.translators_cache_size', TRANSLATORS_CACHE_SIZE))
+
+
+def _cached_translator(pluggable_name, langs):
+    key = (pluggable_name, langs)
+    with _TRANSLATORS_CACHE_LOCK:
+        if key in _TRANSLATORS_CACHE:
+            pluggable_translator = _TRANSLATORS_CACHE.pop(key)
+            _TRANSLATORS_CACHE[key] = pluggable_translator
+            return pluggable_translator
+
+    pluggable_translator = _translator_for_pluggable(langs, pluggable_name)
+
+    with _TRANSLATORS_CACHE_LOCK:
+        pluggable_translator = _TRANSLATORS_CACHE.setdefault(key, pluggable_translator)
+        while len(_TRANSLATORS_CACHE) > _cache_size():
+            _TRANSLATORS_CACHE.popitem(last=False)
+    return pluggable_translator
+
 
+def _copy_chain(pluggable_translator):
+    head = tail = copy.copy(pluggable_translator)
+    while tail._fallback is not None:
+        tail._fallback = copy.copy(tail._fallback)
+        tail = tail._fallback
+    return head
 
-def _translator_for_pluggable(app_translator, pluggable_name):
-    langs = getattr(app_translator, 'tg_lang', []) or []
 
+def _translator_for_pluggable(langs, pluggable_name):
     module = config['tgext.pluggable.plugged']['modules'][pluggable_name]['module']
     localedir = os.path.join(os.path.dirname(module.__file__), 'i18n')
 
     try:
-        translator = _gettext.translation(pluggable_name, localedir, languages=langs,
+        translator = _gettext.translation(pluggable_name, localedir, languages=list(langs),
                                           fallback=True)
     except IOError as ioe:
         raise LanguageError('IOError: %s' % ioe)
@@ -0,0 +1,65 @@
+import sys, pkgutil, threading
+
+_IMPORT_LOCK = threading.RLock()
+
+
+def submodules(module):
+    """Names of the modules and packages provided by a package without importing them"""
+    path = getattr(module, '__path__', None)
+    if path is None:
+        return set()
+    return set(name for _, name, _ in pkgutil.iter_modules(path))
+
+
+class LazyModule(object):
+    """Module that gets imported on first access to one of its attributes.
+
+    Used to expose the helpers and controllers of pluggables plugged
+    with ``lazy=True`` without importing them at startup.
+    """
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _lazy_load(self):
+        module = self._lazy_module
+        if module is None:
+            with _IMPORT_LOCK:
+                __import__(self._lazy_name)
+                module = self.__dict__['_lazy_module'] = sys.modules[self._lazy_name]
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_load(), name)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        return '<LazyModule %r>' % self._lazy_name
+
+
+def lazy_callable(module_name, name):
+    """Callable that imports ``module_name`` and calls its ``name`` function when called"""
+    module = LazyModule(module_name)
+
+    def _lazy_call(*args, **kwargs):
+        return getattr(module, name)(*args, **kwargs)
+    return _lazy_call
+
+
+class LazyController(object):
+    """Placeholder mounted in place of the root controller of a lazily plugged application.
+
+    On the first request the ``loader`` is called to create the actual
+    controller, which is expected to replace the placeholder in the
+    mount point, and the dispatch continues on it.
+    """
+    def __init__(self, loader):
+        self._loader = loader
+
+    def _dispatch(self, state, remainder=None):
+        controller = self._loader()
+        location = state.controller_path[-1][0]
+        state.add_controller(location, controller)
+        return controller._dispatch(state, remainder)
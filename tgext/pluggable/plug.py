@@ -1,6 +1,8 @@
 import logging, inspect
+from collections import OrderedDict
 
 import tg
+from tg.support.converters import asbool
 try:
     # TG >= 2.4
     from tg import ApplicationConfigurator
@@ -14,12 +16,15 @@ except ImportError:
     class ConfigurationComponent: pass
 
 
-from .adapt_models import ModelsAdapter, app_model
+from .adapt_models import ModelsAdapter, app_model, track_partials_dependencies
 from .adapt_controllers import ControllersAdapter
 from .adapt_websetup import WebSetupAdapter
 from .adapt_statics import StaticsAdapter, PluggedStaticsMiddleware
-from .utils import call_partial, plug_url
+from .utils import call_partial, call_partials, plug_url, plug_static_url
 from .i18n import pluggable_translations_wrapper
+from .deferred_partials import DeferredPartialsAdapter, defer_partial, deferred_partials_loader
+from .lazy import LazyModule, lazy_callable, submodules
+from .startup import StartupPhase, measure_startup, measured
 
 log = logging.getLogger('tgext.pluggable')
 
@@ -35,13 +40,15 @@ def plug(app_config, module_name, appid=None, **kwargs):
             'Pluggable application has already been plugged for this application'
         )
 
-    module = __import__(module_name, globals(), locals(), ['plugme'], 0)
+    with measure_startup(plugged, module_name, 'import'):
+        module = __import__(module_name, globals(), locals(), ['plugme'], 0)
 
     plug_options = dict(appid=appid)
     plug_options.update(kwargs)
 
     log.info('Plugging %s', module_name)
-    module_options = module.plugme(app_config, plug_options)
+    with measure_startup(plugged, module_name, 'plugme'):
+        module_options = module.plugme(app_config, plug_options)
     if not appid:
         appid = module_options.get('appid')
 
@@ -113,6 +120,8 @@ class PluggablesConfigurationComponent(ConfigurationComponent):
         return (
             BeforeConfigConfigurationAction(self._configure),
             ConfigReadyConfigurationAction(self._setup),
+            ConfigReadyConfigurationAction(self._track_models_changes),
+            AppReadyConfigurationAction(self._mount_deferred_partials),
             AppReadyConfigurationAction(self._add_middleware),
         )
 
@@ -127,11 +136,28 @@ class PluggablesConfigurationComponent(ConfigurationComponent):
         if not app_helpers:
             return
         app_helpers.call_partial = call_partial
+        app_helpers.call_partials = call_partials
+        app_helpers.defer_partial = defer_partial
+        app_helpers.deferred_partials_loader = deferred_partials_loader
         app_helpers.plug_url = plug_url
+        app_helpers.plug_static_url = plug_static_url
+
+    def _track_models_changes(self, conf, app):
+        track_partials_dependencies(conf)
+
+    def _mount_deferred_partials(self, conf, app):
+        return DeferredPartialsAdapter(conf).mount_controllers(app)
 
     def _add_middleware(self, conf, app):
+        if not asbool(conf.get('tgext.pluggable.serve_statics', True)):
+            return app
+
         plugged = conf['tgext.pluggable.plugged']
-        return PluggedStaticsMiddleware(app, plugged)
+        return PluggedStaticsMiddleware(
+            app, plugged,
+            offload=conf.get('tgext.pluggable.statics_offload'),
+            offload_prefix=conf.get('tgext.pluggable.statics_offload_prefix', '/_pluggable_offload')
+        )
 
 
 def init_pluggables23(app_config):
@@ -163,8 +189,24 @@ def init_pluggables23(app_config):
 
         # Enable plugged statics
         def enable_statics_middleware(app):
-            return PluggedStaticsMiddleware(app, plugged)
+            if not asbool(tg.config.get('tgext.pluggable.serve_statics', True)):
+                return app
+
+            return PluggedStaticsMiddleware(
+                app, plugged,
+                offload=tg.config.get('tgext.pluggable.statics_offload'),
+                offload_prefix=tg.config.get('tgext.pluggable.statics_offload_prefix',
+                                             '/_pluggable_offload')
+            )
         register_tg_hook('after_config', enable_statics_middleware)
+
+        # Invalidate cached partials when models change
+        register_tg_hook('configure_new_app', lambda app: track_partials_dependencies(app.config))
+
+        # Enable endpoint of deferred partials
+        deferred_partials_adapter = DeferredPartialsAdapter(app_config)
+        register_tg_hook('configure_new_app', deferred_partials_adapter.new_app_created)
+        register_tg_hook('after_config', deferred_partials_adapter.mount_controllers)
         
         if app_config.get('i18n.enabled'):
             register_controller_wrapper(pluggable_translations_wrapper)
@@ -176,7 +218,11 @@ def init_pluggables23(app_config):
             if not app_helpers:
                 return
             app_helpers.call_partial = call_partial
+            app_helpers.call_partials = call_partials
+            app_helpers.defer_partial = defer_partial
+            app_helpers.deferred_partials_loader = deferred_partials_loader
             app_helpers.plug_url = plug_url
+            app_helpers.plug_static_url = plug_static_url
             
         try:
             app_helpers = app_config.package.lib.helpers
@@ -213,13 +259,26 @@ class ApplicationPlugger(object):
         if self.plugged['modules'].get(module_name):
             return
 
-        module = __import__(
-            module_name,
-            globals(),
-            locals(),
-            ['plugme', 'model', 'lib', 'helpers', 'controllers', 'bootstrap', 'public', 'partials'],
-            0
-        )
+        lazy = asbool(options.get('lazy', False))
+        # The package itself was imported by plug() and recorded as 'import'
+        with measure_startup(self.plugged, module_name, 'submodules'):
+            if lazy:
+                # Only what is required to setup the application is imported,
+                # everything else is imported on first use.
+                module = __import__(module_name, globals(), locals(), ['plugme', 'model', 'public'], 0)
+                available = submodules(module)
+            else:
+                module = __import__(
+                    module_name,
+                    globals(),
+                    locals(),
+                    ['plugme', 'model', 'lib', 'helpers', 'controllers', 'bootstrap', 'public', 'partials'],
+                    0
+                )
+                available = set()
+
+        def provides(name):
+            return hasattr(module, name) or name in available
 
         appid = options['appid']
 
@@ -227,54 +286,91 @@ class ApplicationPlugger(object):
         self.plugged['modules'][module_name] = dict(appid=appid,
                                                     module_name=module_name,
                                                     module=module,
-                                                    statics=None)
+                                                    lazy=lazy,
+                                                    statics=None,
+                                                    statics_manifest=None,
+                                                    statics_path=None)
 
         if hasattr(module, 'model') and options.get('plug_models', True):
-            models_adapter = ModelsAdapter(tg.config, module.model, options)
-            models_adapter.adapt_tables()
-            models_adapter.init_model()
+            with measure_startup(self.plugged, module_name, 'models'):
+                models_adapter = ModelsAdapter(tg.config, module.model, options)
+                models_adapter.adapt_tables()
+                models_adapter.init_model()
 
-        if hasattr(module, 'helpers') and options.get('plug_helpers', True):
+        if provides('helpers') and options.get('plug_helpers', True):
             enable_global_helpers = options.get('global_helpers', False)
+
+            def plug_helpers(app_helpers):
+                if not lazy or hasattr(module, 'helpers'):
+                    helpers = module.helpers
+                elif enable_global_helpers:
+                    # Global helpers need to be known to be injected
+                    helpers = __import__(module_name + '.helpers', globals(), locals(), ['helpers'], 0)
+                else:
+                    helpers = LazyModule(module_name + '.helpers')
+                self._plug_helpers(app_helpers, enable_global_helpers, module_name, helpers)
+            plug_helpers = measured(self.plugged, module_name, 'helpers', plug_helpers)
+
             try:
                 app_helpers = app_config.package.lib.helpers
             except:
-                tg.hooks.register(
-                    'configure_new_app',
-                    lambda app: self._plug_helpers(app.config.get('helpers'),
-                                                   enable_global_helpers,
-                                                   module_name,
-                                                   module)
-                )
+                tg.hooks.register('configure_new_app', lambda app: plug_helpers(app.config.get('helpers')))
             else:
                 # Backward compatible for versions that didn't have configure_new_app
-                self._plug_helpers(app_helpers, enable_global_helpers, module_name, module)
+                plug_helpers(app_helpers)
 
-        if hasattr(module, 'controllers') and options.get('plug_controller', True):
-            controllers_adapter = ControllersAdapter(tg.config, module.controllers, options)
+        if provides('controllers') and options.get('plug_controller', True):
+            if lazy:
+                controllers = LazyModule(module_name + '.controllers')
+            else:
+                controllers = module.controllers
+            controllers_adapter = ControllersAdapter(tg.config, controllers, dict(options, lazy=lazy))
+            mount_controllers = measured(self.plugged, module_name, 'controllers',
+                                         controllers_adapter.mount_controllers)
             tg.hooks.register('configure_new_app', controllers_adapter.new_app_created)
             if isinstance(app_config, ApplicationConfigurator):
                 # TG2.4
-                tg.hooks.register('after_wsgi_middlewares', controllers_adapter.mount_controllers)
+                tg.hooks.register('after_wsgi_middlewares', mount_controllers)
             else:
                 # TG2.3
-                tg.hooks.register('after_config', controllers_adapter.mount_controllers)
+                tg.hooks.register('after_config', mount_controllers)
 
-        if hasattr(module, 'bootstrap') and options.get('plug_bootstrap', True):
-            websetup_adapter = WebSetupAdapter(tg.config, module, options)
-            websetup_adapter.adapt_bootstrap()
+        if provides('bootstrap') and options.get('plug_bootstrap', True):
+            if lazy:
+                plugin_bootstrap = lazy_callable(module_name + '.bootstrap', 'bootstrap')
+            else:
+                plugin_bootstrap = module.bootstrap.bootstrap
+            with measure_startup(self.plugged, module_name, 'bootstrap'):
+                websetup_adapter = WebSetupAdapter(tg.config, module, options, plugin_bootstrap)
+                websetup_adapter.adapt_bootstrap()
+
+        if not lazy and hasattr(module, 'partials') and options.get('preload_partials', True):
+            # Partials of lazy pluggables are resolved by call_partial on first use
+            with measure_startup(self.plugged, module_name, 'partials'):
+                self._plug_partials(module)
 
         if hasattr(module, 'public') and options.get('plug_statics', True):
-            statics_adapter = StaticsAdapter(tg.config, module, options)
-            statics_adapter.register_statics(module_name, self.plugged)
+            with measure_startup(self.plugged, module_name, 'statics'):
+                statics_adapter = StaticsAdapter(tg.config, module, options)
+                statics_adapter.register_statics(module_name, self.plugged)
+
+    def _plug_partials(self, module):
+        records = call_partial.discover(module.partials)
+        tg.config['tgext.pluggable.partials_cache'].update(records)
 
-    def _plug_helpers(self, app_helpers, enable_global_helpers, module_name, module):
+        # Templates are known only once renderers are available
+        def prepare_partials(app):
+            for record in records.values():
+                record.prepare(app.config)
+        tg.hooks.register('configure_new_app', prepare_partials)
+
+    def _plug_helpers(self, app_helpers, enable_global_helpers, module_name, helpers):
         if app_helpers is None:
             return
-        setattr(app_helpers, module_name, module.helpers)
+        setattr(app_helpers, module_name, helpers)
 
         if enable_global_helpers:
-            for name, impl in inspect.getmembers(module.helpers):
+            for name, impl in inspect.getmembers(helpers):
                 if name.startswith('_'):
                     continue
 
@@ -292,11 +388,40 @@ class SharedPluggedDict(object):
     so the state of plugged apps must be shared across configurator and apps.
     """
     def __init__(self):
-        self._data = {'appids':{}, 'modules':{}}
+        self._data = {'appids':{}, 'modules':{}, 'statics_revision': 0, 'startup': {}}
     def __getitem__(self, item):
         return self._data.__getitem__(item)
     def __setitem__(self, key, value):
         return self._data.__setitem__(key, value)
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def record_startup(self, module_name, phase, duration, memory=None, rss=None):
+        """Records resources spent by a pluggable during a phase of the startup"""
+        phases = self._data['startup'].setdefault(module_name, OrderedDict())
+        if phase not in phases:
+            phases[phase] = StartupPhase(phase)
+        phases[phase].add(duration, memory, rss)
+
+    def startup_report(self, sort_by='duration'):
+        """Resources spent by each pluggable during the application startup.
+
+        Returns a list of dictionaries with the ``pluggable`` name, the ``total``
+        :class:`.StartupPhase` and the list of its ``phases``, sorted by
+        decreasing ``duration``, ``memory`` or ``rss`` or by ``name``.
+        """
+        report = []
+        for module_name, phases in self._data['startup'].items():
+            total = StartupPhase('total')
+            for phase in phases.values():
+                total.add(phase.duration, phase.memory, phase.rss)
+            report.append(dict(pluggable=module_name, total=total, phases=list(phases.values())))
+
+        if sort_by == 'name':
+            report.sort(key=lambda entry: entry['pluggable'])
+        else:
+            report.sort(key=lambda entry: getattr(entry['total'], sort_by) or 0, reverse=True)
+        return report
 
 
 class MissingAppIdException(Exception):
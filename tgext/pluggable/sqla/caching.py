@@ -0,0 +1,44 @@
+import tg
+from sqlalchemy import event
+from sqlalchemy.orm import object_mapper
+
+from ..caching import partials_cache
+
+_CHANGED_TABLES = 'tgext.pluggable.changed_tables'
+
+
+def invalidate_partials_on_commit(DBSession, config):
+    """Invalidates the cached partials that depend on tables changed by a commit.
+
+    Tables of the objects added, changed or deleted during a flush are
+    recorded on the session and invalidated in the partials cache of
+    the application running when the transaction is committed, so
+    that multiple applications can share the same ``DBSession``.
+    Changes performed through bulk queries are not detected.
+
+    Only the cache of the committing process is invalidated, unless
+    the ``sqlite`` partials cache backend shared by all the processes is used.
+    """
+    if event.contains(DBSession, 'after_flush', _record_changed_tables):
+        return
+
+    event.listen(DBSession, 'after_flush', _record_changed_tables)
+    event.listen(DBSession, 'after_commit', _invalidate_changed_tables)
+    event.listen(DBSession, 'after_rollback', _forget_changed_tables)
+
+
+def _record_changed_tables(session, flush_context):
+    changed_tables = session.info.setdefault(_CHANGED_TABLES, set())
+    for instances in (session.new, session.dirty, session.deleted):
+        for instance in instances:
+            changed_tables.update(table.name for table in object_mapper(instance).tables)
+
+
+def _invalidate_changed_tables(session):
+    changed_tables = session.info.pop(_CHANGED_TABLES, None)
+    if changed_tables:
+        partials_cache(tg.config._current_obj()).invalidate(changed_tables)
+
+
+def _forget_changed_tables(session):
+    session.info.pop(_CHANGED_TABLES, None)
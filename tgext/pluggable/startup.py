@@ -0,0 +1,96 @@
+import os, time
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    _timer = time.perf_counter
+except AttributeError:
+    _timer = time.time
+
+
+class StartupPhase(object):
+    """Resources spent by a pluggable during a phase of the application startup.
+
+    ``duration`` is the wall time in seconds. ``memory`` is the growth in bytes
+    of the memory allocated by Python and is only available when
+    :mod:`tracemalloc` is tracing. ``rss`` is the growth in bytes of the
+    resident memory of the process and is ``None`` when it can't be
+    detected on the current platform.
+    """
+    __slots__ = ('name', 'duration', 'memory', 'rss')
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0.0
+        self.memory = None
+        self.rss = None
+
+    def add(self, duration, memory=None, rss=None):
+        self.duration += duration
+        if memory is not None:
+            self.memory = (self.memory or 0) + memory
+        if rss is not None:
+            self.rss = (self.rss or 0) + rss
+
+    def as_dict(self):
+        return dict(name=self.name, duration=self.duration, memory=self.memory, rss=self.rss)
+
+    def __repr__(self):
+        return '<StartupPhase %s %.4fs memory=%s rss=%s>' % (self.name, self.duration,
+                                                            self.memory, self.rss)
+
+
+def _traced_memory():
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return None
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError, IndexError):
+        pass
+
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def _delta(start, end):
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+@contextmanager
+def measure_startup(plugged, module_name, phase):
+    """Records in ``plugged`` the resources spent by ``module_name`` in the block"""
+    start_memory, start_rss = _traced_memory(), _rss()
+    start = _timer()
+    try:
+        yield
+    finally:
+        duration = _timer() - start
+        plugged.record_startup(module_name, phase, duration,
+                               memory=_delta(start_memory, _traced_memory()),
+                               rss=_delta(start_rss, _rss()))
+
+
+def measured(plugged, module_name, phase, func):
+    """Wraps ``func`` so that the resources it spends are recorded as ``phase``"""
+    def _measured(*args, **kwargs):
+        with measure_startup(plugged, module_name, phase):
+            return func(*args, **kwargs)
+    return _measured
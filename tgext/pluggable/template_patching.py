@@ -1,14 +1,40 @@
+from collections import OrderedDict
 from functools import partial
+import copy
+import hashlib
+import io
+import json
 import logging
 import os
 import pkg_resources
+import stat
+import threading
 import tg
+try:
+    from html.parser import HTMLParser
+except ImportError:  # pragma: no cover
+    from HTMLParser import HTMLParser
+from tg.configuration import milestones
+from tg.i18n import get_lang
+from tg.support.converters import asbool
 
 log = logging.getLogger('tgext.pluggable')
 
 _etree = None
 _cssselect = None
 _html = None
+_parse_css = None
+
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+def _user_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    if not os.path.isabs(base):
+        return None
+    return os.path.join(base, 'tgext.pluggable', 'patches')
+
+PATCHES_CACHE_DIR = _user_cache_dir()
+PATCHES_CACHE_VERSION = 1
 
 class MissingPropertyError(Exception):
     pass
@@ -17,10 +43,11 @@ class InvalidActionError(Exception):
     pass
 
 class Patch(object):
-    def __init__(self, template):
+    def __init__(self, template, cache=None):
         if template is None or not template.strip():
             raise MissingPropertyError('template missing for patch')
         self.template = template
+        self.cache = cache
         self.actions = []
 
     def add_action(self, action):
@@ -31,8 +58,9 @@ class Patch(object):
 
 class Action(object):
     VALID_ACTIONS = ('replace', 'append', 'prepend', 'content')
+    FRAGMENTS_CACHE_SIZE = 128
 
-    def __init__(self, name, selector, template):
+    def __init__(self, name, selector, template, cache=None):
         if name not in Action.VALID_ACTIONS:
             raise InvalidActionError('action is not one of the recognized actions: %s' % Action.VALID_ACTIONS)
 
@@ -44,14 +72,85 @@ class Action(object):
 
         self.name = name
         self.selector = _cssselect.CSSSelector(selector)
+        self.compiled_selector = _compile_selector(selector)
         self.template = template
 
+        # None disables caching, otherwise the template variables used as the cache key
+        if cache is None or not cache.strip():
+            self.cache = None
+        elif cache.strip() == 'static':
+            self.cache = ()
+        else:
+            self.cache = tuple(cache.replace(',', ' ').split())
+        self._fragments = OrderedDict()
+        self._fragments_lock = threading.Lock()
+
+    def dump(self):
+        """Action with its compiled selectors as a JSON serializable dictionary"""
+        return dict(name=self.name, css=self.selector.css, xpath=self.selector.path,
+                    compiled_selector=self.compiled_selector, template=self.template,
+                    cache=self.cache)
+
+    @classmethod
+    def load(cls, data):
+        """Restores an action saved by :meth:`dump` without compiling its selector again"""
+        action = cls.__new__(cls)
+        action.name = data['name']
+        action.selector = _cssselect.CSSSelector.__new__(_cssselect.CSSSelector)
+        _etree.XPath.__init__(action.selector, data['xpath'])
+        action.selector.css = data['css']
+        action.compiled_selector = data['compiled_selector']
+        action.template = data['template']
+        action.cache = tuple(data['cache']) if data['cache'] is not None else None
+        action._fragments = OrderedDict()
+        action._fragments_lock = threading.Lock()
+        return action
+
+    def fragment(self, data, render, langs=()):
+        """Parsed content of the action for the template ``data``.
+
+        ``render`` is called to render the content when it is not cached,
+        contents are cached separately for each set of ``langs`` they are rendered in.
+        Returned elements might be cached, so they must be copied before
+        being added to a document.
+        """
+        if self.cache is None:
+            return self._parse(render())
+
+        try:
+            key = (tuple(langs), ) + tuple(data.get(name) for name in self.cache)
+            hash(key)
+        except (AttributeError, TypeError):
+            return self._parse(render())
+
+        with self._fragments_lock:
+            if key in self._fragments:
+                fragment = self._fragments.pop(key)
+                self._fragments[key] = fragment
+                return fragment
+
+        fragment = self._parse(render())
+        with self._fragments_lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.FRAGMENTS_CACHE_SIZE:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def _parse(self, content):
+        if content:
+            return _etree.fromstring(content)
+        return None
+
     def apply(self, node, content):
         if content:
             content = _etree.fromstring(content)
         else:
             content = None
 
+        self._perform(node, content)
+        return content
+
+    def _perform(self, node, content):
         getattr(self, '_perform_%s' % self.name)(node, content)
 
     def _perform_prepend(self, node, content):
@@ -82,30 +181,61 @@ class Action(object):
 def template_patches_store_data(remainder, params, output, *args, **kw):
     tg.request._template_patches_data = output
 
+def _action_fragment(action):
+    if action.template is None:
+        return None
+
+    data = tg.request._template_patches_data
+    return action.fragment(data, lambda: tg.render_template(data, action.engine, action.template),
+                           get_lang() or ())
+
+def _chunks(content, size):
+    for start in range(0, len(content), size):
+        yield content[start:start+size]
+
+def _encoded(chunks, charset):
+    for chunk in chunks:
+        yield chunk.encode(charset)
+
 def template_patches_hook(response, *args, **kw):
     patched_template = response.get('template_name')
     if patched_template is None:
         return
 
-    patches = tg.config._pluggable_templates_patches
-    template_patches = patches.get(patched_template)
-    if template_patches is None:
+    if tg.config._pluggable_templates_patches_mtimes is not None:
+        _reload_template_patches(tg.config._current_obj())
+
+    matcher = tg.config._pluggable_templates_runtime_patches.get(patched_template)
+    if not matcher:
         return
 
-    root = _html.document_fromstring(response['response'])
-    for patch in template_patches:
-        for action in patch.actions:
-            nodes = action.selector(root)
-            if nodes:
-                if action.template is not None:
-                    content = tg.render_template(tg.request._template_patches_data, action.engine, action.template)
-                else:
-                    content = ""
+    charset = tg.response.charset
+    if not charset:
+        charset = tg.response.charset = 'utf-8'
+    response['response'] = patch_content(matcher, response['response'], _action_fragment,
+                                         tg.config._pluggable_templates_streaming_size, charset)
 
-            for node in nodes:
-                action.apply(node, content)
+def patch_content(matcher, content, action_fragment, streaming_size=None, charset='utf-8'):
+    """Applies the actions of ``matcher`` to the rendered ``content``.
 
-    response['response'] = _html.tostring(root, doctype=root.getroottree().docinfo.doctype)
+    Content at least ``streaming_size`` characters long is patched by
+    :class:`StreamingPatcher` when possible, in such case an iterator
+    over the encoded output is returned instead of bytes.
+    Content with elements that are not explicitly closed is always
+    patched as a tree, as lxml repairs it before matching the actions.
+    """
+    if streaming_size is not None and len(content) >= streaming_size and \
+            matcher.streamable and not isinstance(content, bytes):
+        # Fragments are rendered in advance, as the response is consumed
+        # after the request, and only if the following actions can't match them.
+        fragments = matcher.streaming_fragments(action_fragment)
+        if fragments is not None and _is_balanced(content):
+            patcher = StreamingPatcher(matcher, fragments.get)
+            return _encoded(patcher.patch(_chunks(content, STREAMING_CHUNK_SIZE)), charset)
+
+    root = _html.document_fromstring(content)
+    matcher.apply(root, action_fragment)
+    return _html.tostring(root, doctype=root.getroottree().docinfo.doctype)
 
 def init_template_patches(app_config, conf=None):
     _import_etree()
@@ -115,6 +245,31 @@ def init_template_patches(app_config, conf=None):
         conf = app_config
 
     patches = conf['_pluggable_templates_patches']
+    _resolve_actions_engines(conf, patches)
+
+    # Actions that have to be applied to the rendered response,
+    # those compiled into the template source are removed from here.
+    conf['_pluggable_templates_runtime_patches'] = _create_matchers(patches)
+
+    streaming_size = conf.get('tgext.pluggable.streaming_template_patches')
+    conf['_pluggable_templates_streaming_size'] = int(streaming_size) if streaming_size not in (None, '') else None
+
+    conf['_pluggable_templates_patches_mtimes'] = None
+    if asbool(conf.get('tgext.pluggable.reload_template_patches', False)):
+        patches_files = conf.get('_pluggable_templates_patches_files', [])
+        conf['_pluggable_templates_patches_mtimes'] = dict((patches_file, _mtime(patches_file))
+                                                          for patches_file in patches_files)
+    elif asbool(conf.get('tgext.pluggable.compile_template_patches', False)):
+        milestones.renderers_ready.register(partial(_install_patches_compiler, conf))
+
+    try:  # TG2.3
+        app_config.register_hook('before_render', template_patches_store_data)
+        app_config.register_hook('after_render', template_patches_hook)
+    except AttributeError:  # TG2.4+
+        tg.hooks.register('before_render', template_patches_store_data)
+        tg.hooks.register('after_render', template_patches_hook)
+        
+def _resolve_actions_engines(conf, patches):
     for replaced_template, patches_list in patches.items():
         for patch in patches_list:
             for action in patch.actions:
@@ -130,15 +285,750 @@ def init_template_patches(app_config, conf=None):
                 action.engine = engine
                 action.template = template
 
-    try:  # TG2.3
-        app_config.register_hook('before_render', template_patches_store_data)
-        app_config.register_hook('after_render', template_patches_hook)
-    except AttributeError:  # TG2.4+
-        tg.hooks.register('before_render', template_patches_store_data)
-        tg.hooks.register('after_render', template_patches_hook)
-        
+def _create_matchers(patches):
+    return dict(
+        (template, PatchesMatcher([action for patch in patches_list for action in patch.actions]))
+        for template, patches_list in patches.items()
+    )
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _reload_template_patches(conf):
+    """Loads again all the patches files when any of them changed"""
+    mtimes = conf['_pluggable_templates_patches_mtimes']
+    changed = dict((patches_file, _mtime(patches_file)) for patches_file in mtimes)
+    if changed == mtimes:
+        return
+
+    patches = {}
+    for patches_file, mtime in changed.items():
+        if mtime is not None:
+            _parse_patchfile(patches, patches_file)
+    _resolve_actions_engines(conf, patches)
+
+    conf['_pluggable_templates_patches'] = patches
+    conf['_pluggable_templates_runtime_patches'] = _create_matchers(patches)
+    conf['_pluggable_templates_patches_mtimes'] = changed
+
+class PatchesMatcher(object):
+    """Applies a list of actions to a document walking its tree only once.
+
+    Selectors made of tags, ids, classes, attributes and descendant or child
+    combinators are indexed by the id, class or tag of their rightmost element,
+    so that each node of the document is only checked against the
+    actions that could match it. Nodes matched in advance are
+    skipped if a previous action removed them and the content
+    inserted by an action is matched against the following actions,
+    so the result is the same of running each selector
+    after the previous actions were applied.
+
+    Actions with other selectors are looked up by running their
+    selector when they have to be applied.
+    """
+    def __init__(self, actions):
+        self.actions = actions
+
+        self._by_id = {}
+        self._by_class = {}
+        self._by_tag = {}
+        self._universal = []
+        self._lookup = set()
+        # Rightmost compounds of the selectors following each action that inserts content
+        self._following = {}
+        for index, action in enumerate(actions):
+            if action.template is not None and actions[index + 1:]:
+                self._following[index] = [selector[0][0] for following in actions[index + 1:]
+                                          for selector in following.compiled_selector or ()]
+
+            selectors = action.compiled_selector
+            if selectors is None:
+                self._lookup.add(index)
+                continue
+
+            for selector in selectors:
+                tag, id_, classes, _ = selector[0][0]
+                if id_ is not None:
+                    self._by_id.setdefault(id_, []).append((index, selector))
+                elif classes:
+                    self._by_class.setdefault(classes[0], []).append((index, selector))
+                elif tag is not None:
+                    self._by_tag.setdefault(tag, []).append((index, selector))
+                else:
+                    self._universal.append((index, selector))
+
+    def __len__(self):
+        return len(self.actions)
+
+    def match(self, root, first_action=0):
+        """Nodes of the ``root`` tree matched by each action starting from ``first_action``"""
+        matches = [[] for _ in self.actions]
+        for node in root.iter(_etree.Element):
+            candidates = self._candidates(node)
+            if not candidates:
+                continue
+
+            for index, selector in candidates:
+                if index < first_action:
+                    continue
+                nodes = matches[index]
+                if (not nodes or nodes[-1] is not node) and _selector_matches(selector, node):
+                    nodes.append(node)
+        return matches
+
+    @property
+    def streamable(self):
+        """If all the actions can be applied by :class:`StreamingPatcher`"""
+        return not self._lookup
+
+    def streaming_fragments(self, action_fragment):
+        """Parsed content of each action for :class:`StreamingPatcher`.
+
+        Returns ``None`` when the content of an action could be matched
+        by any of the following ones, as the streaming patcher doesn't
+        match inserted content while patching the tree does.
+        """
+        fragments = {}
+        for index, action in enumerate(self.actions):
+            fragment = fragments[action] = action_fragment(action)
+            if fragment is None or index not in self._following:
+                continue
+
+            for node in fragment.iter(_etree.Element):
+                for compound in self._following[index]:
+                    if _compound_matches(compound, node):
+                        return None
+        return fragments
+
+    def matching_actions(self, node):
+        """Indexes of the actions matching ``node``, excluding the ones that require a lookup"""
+        candidates = self._candidates(node)
+        if not candidates:
+            return []
+        return sorted(set(index for index, selector in candidates if _selector_matches(selector, node)))
+
+    def _candidates(self, node):
+        candidates = self._by_tag.get(node.tag)
+        if self._universal:
+            candidates = self._universal + (candidates or [])
+
+        node_id = node.get('id')
+        if node_id is not None and node_id in self._by_id:
+            candidates = self._by_id[node_id] + (candidates or [])
+
+        node_classes = node.get('class')
+        if node_classes is not None:
+            by_class = self._by_class
+            for class_name in node_classes.split():
+                if class_name in by_class:
+                    candidates = by_class[class_name] + (candidates or [])
+        return candidates
+
+    def apply(self, root, action_fragment):
+        """Applies the actions to the ``root`` tree.
+
+        ``action_fragment`` is called with the action to get its parsed
+        content once for each action that matched at least a node.
+        """
+        matches = self.match(root)
+        removing = False
+        for index, action in enumerate(self.actions):
+            if index in self._lookup:
+                nodes = action.selector(root)
+            elif removing:
+                nodes = [node for node in matches[index] if _is_descendant(node, root)]
+            else:
+                nodes = matches[index]
+
+            if not nodes:
+                continue
+
+            fragment = action_fragment(action)
+            for node in nodes:
+                inserted = copy.deepcopy(fragment) if fragment is not None else None
+                action._perform(node, inserted)
+                if inserted is not None and index + 1 < len(self.actions):
+                    for following, inserted_nodes in enumerate(self.match(inserted, index + 1)):
+                        matches[following].extend(inserted_nodes)
+            removing = removing or action.name in ('replace', 'content')
+
+class _StreamElement(object):
+    __slots__ = ('tag', 'attrib', 'parent')
+
+    def __init__(self, tag, attrib, parent):
+        self.tag = tag
+        self.attrib = attrib
+        self.parent = parent
+
+    def get(self, name, default=None):
+        return self.attrib.get(name, default)
+
+    def getparent(self):
+        return self.parent
+
+class StreamingPatcher(HTMLParser):
+    """Applies the actions of a :class:`PatchesMatcher` while parsing the document.
+
+    The document is never loaded as a tree, elements are matched
+    as their start tag is parsed and the output is emitted as soon
+    as the input is parsed. Only the matchers that are
+    :attr:`PatchesMatcher.streamable` are supported and the content
+    inserted by an action is never matched by the following ones,
+    so it must be used only with the fragments returned by
+    :meth:`PatchesMatcher.streaming_fragments`.
+    """
+    VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+                               'link', 'meta', 'param', 'source', 'track', 'wbr'))
+    BLOCK_ELEMENTS = ('address', 'article', 'aside', 'blockquote', 'div', 'dl', 'fieldset', 'footer',
+                      'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'main', 'nav',
+                      'ol', 'p', 'pre', 'section', 'table', 'ul')
+    # Open elements that are implicitly closed by a start tag
+    IMPLICITLY_CLOSED = dict([('li', ('li', )), ('dt', ('dt', 'dd')), ('dd', ('dt', 'dd')),
+                              ('tr', ('tr', 'td', 'th')), ('td', ('td', 'th')), ('th', ('td', 'th')),
+                              ('option', ('option', ))] +
+                             [(tag, ('p', )) for tag in BLOCK_ELEMENTS])
+    NORMAL, CONTENT, REPLACED = range(3)
+
+    def __init__(self, matcher, action_fragment):
+        try:
+            HTMLParser.__init__(self, convert_charrefs=False)
+        except TypeError:  # pragma: no cover
+            HTMLParser.__init__(self)
+        self.matcher = matcher
+        self.action_fragment = action_fragment
+
+        self._output = []
+        self._stack = []
+        self._suppressed = None
+        self._pending = []
+        self._drop_tail = False
+        self._fragments = {}
+
+    def patch(self, chunks):
+        """Yields the patched document while ``chunks`` of the input are parsed"""
+        for chunk in chunks:
+            self.feed(chunk)
+            if self._output:
+                yield ''.join(self._output)
+                del self._output[:]
+
+        self.close()
+        while self._stack:
+            self._close_element(emit_tag=False)
+            self._end_tail()
+        if self._output:
+            yield ''.join(self._output)
+            del self._output[:]
+
+    def _fragment(self, index):
+        try:
+            return self._fragments[index]
+        except KeyError:
+            fragment = self.action_fragment(self.matcher.actions[index])
+            if fragment is not None:
+                fragment = _html.tostring(fragment, encoding='unicode')
+            self._fragments[index] = fragment
+            return fragment
+
+    def _emit(self, text):
+        if self._suppressed is None and not self._drop_tail:
+            self._output.append(text)
+
+    def _end_tail(self):
+        # Appended content goes after the text following the element, like lxml addnext
+        self._drop_tail = False
+        if self._pending and self._suppressed is None:
+            self._output.extend(self._pending)
+        del self._pending[:]
+
+    def handle_starttag(self, tag, attrs):
+        self._start_element(tag, attrs, self.get_starttag_text())
+        if tag in self.VOID_ELEMENTS:
+            self._close_element(emit_tag=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start_element(tag, attrs, self.get_starttag_text())
+        self._close_element(emit_tag=False)
+
+    def _start_element(self, tag, attrs, text):
+        self._end_tail()
+        closed_tags = self.IMPLICITLY_CLOSED.get(tag, ())
+        while self._stack and self._stack[-1][0].tag in closed_tags:
+            self._close_element(emit_tag=True)
+            self._end_tail()
+        parent = self._stack[-1][0] if self._stack else None
+        element = _StreamElement(tag, dict((name, value or '') for name, value in attrs), parent)
+        if self._suppressed is not None:
+            self._stack.append((element, self.NORMAL, ()))
+            return
+
+        before, after, content, state = [], [], None, self.NORMAL
+        for index in self.matcher.matching_actions(element):
+            name = self.matcher.actions[index].name
+            fragment = self._fragment(index)
+            if name == 'prepend':
+                before.append(fragment)
+            elif name == 'append':
+                after.insert(0, fragment)
+            elif name == 'content':
+                content, state = fragment, self.CONTENT
+            elif name == 'replace':
+                before.append(fragment)
+                state = self.REPLACED
+                break
+
+        self._output.extend(fragment for fragment in before if fragment)
+        if state == self.REPLACED:
+            self._output.extend(fragment for fragment in after if fragment)
+            after = ()
+        else:
+            self._output.append(text)
+            if content:
+                self._output.append(content)
+
+        self._stack.append((element, state, after))
+        if state != self.NORMAL:
+            self._suppressed = len(self._stack)
+
+    def handle_endtag(self, tag):
+        for position in range(len(self._stack) - 1, -1, -1):
+            if self._stack[position][0].tag == tag:
+                break
+        else:
+            self._end_tail()
+            self._emit('</%s>' % tag)
+            return
+
+        self._end_tail()
+        while len(self._stack) > position + 1:
+            # Elements closed implicitly by the end of their parent
+            self._close_element(emit_tag=True)
+            self._end_tail()
+        self._close_element(emit_tag=True)
+
+    def _close_element(self, emit_tag):
+        element, state, after = self._stack.pop()
+        if self._suppressed is not None and len(self._stack) + 1 > self._suppressed:
+            return
+
+        if state == self.REPLACED:
+            self._suppressed = None
+            self._drop_tail = True
+            return
+
+        if state == self.CONTENT:
+            self._suppressed = None
+        if emit_tag:
+            self._output.append('</%s>' % element.tag)
+        self._pending.extend(fragment for fragment in after if fragment)
+
+    def handle_data(self, data):
+        self._emit(data)
+
+    def handle_entityref(self, name):
+        self._emit('&%s;' % name)
+
+    def handle_charref(self, name):
+        self._emit('&#%s;' % name)
+
+    def handle_comment(self, data):
+        self._end_tail()
+        self._emit('<!--%s-->' % data)
+
+    def handle_decl(self, decl):
+        self._end_tail()
+        self._emit('<!%s>' % decl)
+
+    def handle_pi(self, data):
+        self._end_tail()
+        self._emit('<?%s>' % data)
+
+    def unknown_decl(self, data):
+        self._end_tail()
+        self._emit('<![%s]>' % data)
+
+class _UnbalancedHTMLError(Exception):
+    pass
+
+class _BalanceChecker(HTMLParser):
+    """Checks that all the elements of a document are explicitly closed.
+
+    Malformed documents, or documents missing the ``html``, ``head`` and ``body``
+    structure, are repaired by lxml before they are patched,
+    so :class:`StreamingPatcher` can only be used for balanced ones.
+    """
+    HEAD_ELEMENTS = frozenset(('base', 'link', 'meta', 'noscript', 'script', 'style',
+                               'template', 'title'))
+    ALLOWED_CHILDREN = {None: frozenset(('html', )),
+                        'html': frozenset(('head', 'body'))}
+
+    def __init__(self):
+        try:
+            HTMLParser.__init__(self, convert_charrefs=False)
+        except TypeError:  # pragma: no cover
+            HTMLParser.__init__(self)
+        self._stack = []
+
+    def handle_starttag(self, tag, attrs):
+        self.handle_startendtag(tag, attrs)
+        if tag not in StreamingPatcher.VOID_ELEMENTS:
+            self._stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        parent = self._stack[-1] if self._stack else None
+        if parent in StreamingPatcher.IMPLICITLY_CLOSED.get(tag, ()):
+            raise _UnbalancedHTMLError(tag)
+        if tag not in self.ALLOWED_CHILDREN.get(parent, (tag, )):
+            raise _UnbalancedHTMLError(tag)
+        if parent == 'head' and tag not in self.HEAD_ELEMENTS:
+            raise _UnbalancedHTMLError(tag)
+
+    def handle_endtag(self, tag):
+        if not self._stack or self._stack.pop() != tag:
+            raise _UnbalancedHTMLError(tag)
+
+def _is_balanced(content):
+    checker = _BalanceChecker()
+    try:
+        checker.feed(content)
+        checker.close()
+    except _UnbalancedHTMLError:
+        return False
+    return not checker._stack
+
+def _compile_selector(css):
+    """Converts a CSS selector to a list of alternatives for :func:`_selector_matches`.
+
+    Each alternative is a list of ``(compound, combinator)`` steps from the
+    rightmost one, where the combinator relates the step to the following one.
+    Returns ``None`` for selectors that are not supported.
+    """
+    try:
+        parsed = _parse_css(css)
+    except Exception:
+        return None
+
+    selectors = []
+    for selector in parsed:
+        if selector.pseudo_element is not None:
+            return None
+
+        steps = []
+        tree = selector.parsed_tree
+        while tree is not None:
+            if type(tree).__name__ == 'CombinedSelector':
+                if tree.combinator not in (' ', '>'):
+                    return None
+                compound, combinator = _compile_compound(tree.subselector), tree.combinator
+                tree = tree.selector
+            else:
+                compound, combinator = _compile_compound(tree), None
+                tree = None
+
+            if compound is None:
+                return None
+            steps.append((compound, combinator))
+        selectors.append(steps)
+    return selectors
+
+def _compile_compound(tree):
+    tag, id_, classes, attributes = None, None, [], []
+    while True:
+        kind = type(tree).__name__
+        if kind == 'Element':
+            if tree.namespace is not None:
+                return None
+            tag = tree.element
+            break
+        elif kind == 'Hash':
+            id_ = tree.id
+        elif kind == 'Class':
+            classes.append(tree.class_name)
+        elif kind == 'Attrib':
+            if tree.namespace is not None or tree.operator not in ('exists', '=', '~='):
+                return None
+            value = getattr(tree.value, 'value', tree.value)
+            attributes.append((tree.attrib, tree.operator, value))
+        else:
+            return None
+        tree = tree.selector
+
+    classes.reverse()
+    return tag, id_, tuple(classes), tuple(attributes)
+
+def _compound_matches(compound, node):
+    tag, id_, classes, attributes = compound
+    if tag is not None and node.tag != tag:
+        return False
+    if id_ is not None and node.get('id') != id_:
+        return False
+    if classes:
+        node_classes = node.get('class', '').split()
+        for class_name in classes:
+            if class_name not in node_classes:
+                return False
+    for name, operator, value in attributes:
+        node_value = node.get(name)
+        if node_value is None:
+            return False
+        if operator == '=' and node_value != value:
+            return False
+        if operator == '~=' and value not in node_value.split():
+            return False
+    return True
+
+def _selector_matches(selector, node, step=0):
+    compound, combinator = selector[step]
+    if not _compound_matches(compound, node):
+        return False
+    if combinator is None:
+        return True
+
+    parent = node.getparent()
+    if combinator == '>':
+        return parent is not None and _selector_matches(selector, parent, step + 1)
+
+    while parent is not None:
+        if _selector_matches(selector, parent, step + 1):
+            return True
+        parent = parent.getparent()
+    return False
+
+def _is_descendant(node, root):
+    while node is not None:
+        if node is root:
+            return True
+        node = node.getparent()
+    return False
+
+def _install_patches_compiler(conf):
+    renderer = conf['render_functions'].get('kajiki')
+    if getattr(renderer, 'loader', None) is None:
+        return
+
+    # Same options the Kajiki renderer of TurboGears provides to its loader
+    from tg.configuration.utils import coerce_config
+    from tg.renderers.kajiki import KajikiRenderer
+    options = coerce_config(conf, 'templating.kajiki.', KajikiRenderer.CONFIG_OPTIONS)
+    if options.get('force_mode', 'html5') == 'text':
+        return
+
+    renderer.loader = KajikiPatchesCompiler(renderer.loader, conf['_pluggable_templates_patches'],
+                                            conf['_pluggable_templates_runtime_patches'], options,
+                                            reload=asbool(conf.get('auto_reload_templates', False)))
+
+class KajikiPatchesCompiler(object):
+    """Kajiki loader that applies template patches to the source of the templates.
+
+    Wraps the loader of the TurboGears Kajiki renderer, templates without
+    patches and the ones included or extended by them are loaded by it.
+
+    Patches can be compiled only when they match the same elements in the source
+    and in the rendered response: the template must not extend or include other
+    templates, the selector must only use tags, ids, classes, attributes and
+    descendant or child combinators, no element the selector could match must
+    have ``py:`` directives or expressions in the attributes used by the selector
+    (on itself or on its ancestors) and the action templates must be Kajiki
+    templates too. Markup emitted by ``${}`` expressions is not part of the source,
+    so compiled actions never match the elements it contains, while they would
+    when applied to the rendered response. Actions that can't be compiled,
+    and all the ones following them, are left to be applied to the rendered response.
+    """
+    FORBIDDEN_DIRECTIVES = ('extends', 'include', 'import')
+
+    def __init__(self, loader, patches, runtime_patches, options=None, reload=False):
+        self.loader = loader
+        self.patches = patches
+        self.runtime_patches = runtime_patches
+        self.reload = reload
+
+        options = dict(options or {})
+        self._mode = options.pop('force_mode', 'html5')
+        self._autoblocks = options.pop('xml_autoblocks', None)
+        options.pop('template_extension', None)
+        options.pop('autoescape_text', None)
+        self._template_options = options
+        self._templates = {}
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def load(self, name, encoding='utf-8', **kwargs):
+        if not self.patches.get(name):
+            return self.loader.load(name, encoding=encoding, **kwargs)
+
+        template = self._templates.get(name)
+        if template is None or self.reload:
+            template = self._templates[name] = self._compile_template(name, encoding, **kwargs)
+        return template
+
+    import_ = load
+
+    def _compile_template(self, name, encoding, **kwargs):
+        filename = self._filename(name)
+        if filename is None:
+            log.info('Template patches of %s not compiled, the template is not a dotted name', name)
+            return self.loader.load(name, encoding=encoding, **kwargs)
+
+        with io.open(filename, encoding=encoding) as f:
+            source = f.read()
+
+        actions = [action for patch in self.patches[name] for action in patch.actions]
+        source, compiled = self.compile(source, actions, encoding)
+        self.runtime_patches[name] = PatchesMatcher(actions[compiled:])
+        if not compiled:
+            log.info('Template patches of %s not compiled, they are applied to the '
+                     'rendered output', name)
+            return self.loader.load(name, encoding=encoding, **kwargs)
+        if compiled < len(actions):
+            log.info('Compiled %s of %s template patches into %s, the others are applied to the '
+                     'rendered output', compiled, len(actions), name)
+
+        from kajiki import XMLTemplate
+        options = dict(self._template_options)
+        options.update(kwargs)
+        template = XMLTemplate(source=source, filename=str(filename), mode=self._mode,
+                               autoblocks=self._autoblocks, **options)
+        # Templates imported by the patched template are loaded by the renderer loader
+        template.loader = self.loader
+        return template
+
+    def _filename(self, name):
+        finder = getattr(self.loader, 'dotted_finder', None)
+        extension = getattr(self.loader, 'template_extension', '.xhtml')
+        if finder is None or name.endswith(extension):
+            return None
+        return finder.get_dotted_filename(template_name=name, template_extension=extension)
+
+    def compile(self, source, actions, encoding):
+        """Applies the longest compilable sequence of ``actions`` to ``source``.
+
+        Returns the patched source and the number of applied actions.
+        """
+        tree = self._parse(source)
+        if tree is None:
+            return source, 0
+
+        root = tree.getroot()
+        compiled = 0
+        for action in actions:
+            if not self._is_static(action, root):
+                break
+
+            nodes = action.selector(root)
+            if not nodes or any(not self._is_patchable(node, root) for node in nodes):
+                break
+
+            content = None
+            if action.template is not None:
+                content = self._fragment(action, encoding)
+                if content is None:
+                    break
+
+            for node in nodes:
+                action._perform(node, copy.deepcopy(content) if content is not None else None)
+            compiled += 1
+
+        if not compiled:
+            return source, 0
+        return _etree.tostring(tree, encoding='unicode'), compiled
+
+    def _fragment(self, action, encoding):
+        if action.engine != 'kajiki' or not action.template:
+            return None
+
+        filename = self._filename(action.template)
+        if filename is None:
+            return None
+        try:
+            with io.open(filename, encoding=encoding) as f:
+                tree = self._parse(f.read())
+        except IOError:
+            return None
+        return tree.getroot() if tree is not None else None
+
+    def _parse(self, source):
+        parser = _etree.XMLParser(resolve_entities=False, strip_cdata=False)
+        try:
+            root = _etree.fromstring(source.encode('utf-8'), parser)
+        except _etree.XMLSyntaxError:
+            return None
+
+        py_namespace = root.nsmap.get('py')
+        for element in root.iter(_etree.Element):
+            namespace = _etree.QName(element).namespace
+            if namespace is None:
+                continue
+            if namespace != py_namespace:
+                # Selectors can't match namespaced elements
+                return None
+            if _etree.QName(element).localname in self.FORBIDDEN_DIRECTIVES:
+                log.info('Unable to compile template patches, template uses py:%s',
+                         _etree.QName(element).localname)
+                return None
+        return root.getroottree()
+
+    def _is_static(self, action, root):
+        """Whenever ``action`` matches the same elements in the source and in the output.
+
+        Elements inside ``py:`` directives or whose attributes used by the
+        selector are expressions might match, or not, only once rendered.
+        """
+        selectors = action.compiled_selector
+        if not selectors:
+            return False
+
+        used_attributes = set()
+        for steps in selectors:
+            for (tag, id_, classes, attributes), combinator in steps:
+                if id_ is not None:
+                    used_attributes.add('id')
+                if classes:
+                    used_attributes.add('class')
+                used_attributes.update(attribute[0] for attribute in attributes)
+
+        dynamic = {}
+        for element in root.iter(_etree.Element):
+            dynamic[element] = dynamic.get(element.getparent(), False) or \
+                _etree.QName(element).namespace is not None or \
+                any(self._is_directive(attr) for attr in element.attrib) or \
+                any('$' in element.get(attr, '') for attr in used_attributes)
+            if dynamic[element] and any(self._may_match(steps[0][0], element) for steps in selectors):
+                return False
+        return True
+
+    def _may_match(self, compound, node):
+        tag, id_, classes, attributes = compound
+        if _etree.QName(node).namespace is not None or (tag is not None and node.tag != tag):
+            return False
+        if any(self._is_directive(attr) and _etree.QName(attr).localname == 'attrs' for attr in node.attrib):
+            return True
+
+        expressions = set(name for name, value in node.attrib.items() if '$' in value)
+        if 'id' in expressions:
+            id_ = None
+        if 'class' in expressions:
+            classes = ()
+        attributes = [attribute for attribute in attributes if attribute[0] not in expressions]
+        return _compound_matches((tag, id_, classes, attributes), node)
+
+    def _is_directive(self, attr):
+        return attr.startswith('{') or attr.startswith('py:')
+
+    def _is_patchable(self, node, root):
+        if node is root or _etree.QName(node).namespace is not None:
+            return False
+
+        for attr in node.attrib:
+            if self._is_directive(attr):
+                return False
+        return True
+
 def _import_etree():
-    global _etree, _cssselect, _html
+    global _etree, _cssselect, _html, _parse_css
     if _etree is None:
         try:
             from lxml import html as _html
@@ -148,6 +1038,7 @@ def _import_etree():
 
         try:
             from lxml import cssselect as _cssselect
+            from cssselect import parse as _parse_css
         except ImportError:
             log.error('Template patching requires cssselect, please install cssselect before using it')
 
@@ -159,14 +1050,77 @@ def _parse_patchfile(patches, patches_file):
     context = _etree.iterparse(patches_file, events=('start',))
     for step, elem in context:
         if elem.tag == 'patch':
-            current_patch = Patch(elem.get('template'))
+            current_patch = Patch(elem.get('template'), elem.get('cache'))
             patches.setdefault(current_patch.template, []).append(current_patch)
         elif elem.tag in Action.VALID_ACTIONS and current_patch is not None:
-            current_patch.add_action(Action(elem.tag, elem.get('selector'), elem.get('template')))
+            current_patch.add_action(Action(elem.tag, elem.get('selector'), elem.get('template'),
+                                            elem.get('cache', current_patch.cache)))
+
+    return patches
+
+def _is_private_dir(path):
+    """Whenever ``path`` is a directory that only the current user can write"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if not hasattr(os, 'getuid'):  # pragma: no cover
+        return True
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def _load_patchfile(patches, patches_file, cache_dir):
+    """Parses ``patches_file`` reusing its compiled version from ``cache_dir`` when up to date"""
+    if not cache_dir:
+        return _parse_patchfile(patches, patches_file)
+
+    _import_etree()
+    with open(patches_file, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+
+    cache_file = os.path.join(cache_dir, hashlib.sha1(os.path.abspath(patches_file).encode('utf-8')).hexdigest())
+    compiled = None
+    if _is_private_dir(cache_dir):
+        try:
+            with open(cache_file + '.json') as f:
+                compiled = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+    if compiled is not None and compiled.get('version') == PATCHES_CACHE_VERSION and \
+            compiled.get('digest') == digest:
+        log.info('Loading Compiled Patches: %s' % patches_file)
+        for compiled_patch in compiled['patches']:
+            patch = Patch(compiled_patch['template'], compiled_patch['cache'])
+            for compiled_action in compiled_patch['actions']:
+                patch.add_action(Action.load(compiled_action))
+            patches.setdefault(patch.template, []).append(patch)
+        return patches
+
+    file_patches = _parse_patchfile({}, patches_file)
+    compiled = dict(version=PATCHES_CACHE_VERSION, digest=digest, patches=[
+        dict(template=patch.template, cache=patch.cache, actions=[action.dump() for action in patch.actions])
+        for patches_list in file_patches.values() for patch in patches_list
+    ])
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        if not _is_private_dir(cache_dir):
+            log.warn('Not caching compiled patches, %s is accessible by other users' % cache_dir)
+        else:
+            temporary_file = '%s.%s.tmp' % (cache_file, os.getpid())
+            with open(temporary_file, 'w') as f:
+                json.dump(compiled, f)
+            getattr(os, 'replace', os.rename)(temporary_file, cache_file + '.json')
+    except (IOError, OSError) as e:
+        log.warn('Unable to cache compiled patches in %s: %s' % (cache_dir, e))
 
+    for template, patches_list in file_patches.items():
+        patches.setdefault(template, []).extend(patches_list)
     return patches
 
-def load_template_patches(app_config, module_name=None):
+def load_template_patches(app_config, module_name=None, cache_dir=PATCHES_CACHE_DIR):
     if module_name is None:
         try:  # TG>=2.4
             module_name = app_config.get_blueprint_value('package').__name__
@@ -183,16 +1137,21 @@ def load_template_patches(app_config, module_name=None):
 
     try: # TG>=2.4
         patches = app_config.get_blueprint_value('_pluggable_templates_patches')
+        patches_files = app_config.get_blueprint_value('_pluggable_templates_patches_files')
     except KeyError:
-        patches = {}
-        app_config.update_blueprint({'_pluggable_templates_patches': patches})
+        patches, patches_files = {}, []
+        app_config.update_blueprint({'_pluggable_templates_patches': patches,
+                                     '_pluggable_templates_patches_files': patches_files})
     except AttributeError:  # TG<=2.3
         try:
             patches = app_config._pluggable_templates_patches
+            patches_files = app_config._pluggable_templates_patches_files
         except:
             patches = app_config._pluggable_templates_patches = {}
+            patches_files = app_config._pluggable_templates_patches_files = []
 
-    _parse_patchfile(patches, patches_file)
+    patches_files.append(patches_file)
+    _load_patchfile(patches, patches_file, cache_dir)
 
     try:  # TG2.3
         app_config.register_hook('startup', partial(init_template_patches, app_config))
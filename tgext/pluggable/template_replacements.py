@@ -1,8 +1,12 @@
 from functools import partial
 
 import tg
-from tg import request, response, tmpl_context
-from tg.decorators import Decoration, override_template
+from tg import request
+from tg.controllers import DecoratedController
+from tg.decorators import Decoration
+from tg.wsgiapp import TGApp
+
+from .lazy import LazyController
 
 
 def replace_template(app_config, past_template, template):
@@ -34,9 +38,129 @@ def replace_template(app_config, past_template, template):
     templates_replacements[past_template] = template
 
 
-def _replace_template_hook(remainder, params, output):
-    req = request._current_obj()
+class _TemplateReplacementsApplier(object):
+    """Applies the templates replacements once the controllers of the application are mounted.
+
+    Templates chosen while serving a request, through ``override_template``
+    or by controllers that the walk couldn't reach, are replaced
+    by :meth:`replace_rendered_template`.
+    """
+    def __init__(self, templates_replacements):
+        self.templates_replacements = templates_replacements
+        self.tgapp = None
+        self.dynamic_controllers = True
+        self._registered = False
+
+    def new_app_created(self, tgapp):
+        self.tgapp = tgapp
+        if not self._registered:
+            # Registered here to run after the hooks that mount the pluggables controllers
+            self._registered = True
+            tg.hooks.register('after_wsgi_middlewares', self.apply)
+
+    def apply(self, app):
+        tgapp = self.tgapp
+        if tgapp is None:
+            tgapp = TGApp()
+
+        # A root_controller configured for the application takes precedence
+        root = tgapp.controller_instances.get('root') or tgapp.find_controller('root')
+        self.dynamic_controllers = apply_templates_replacements(root, self.templates_replacements)
+        return app
+
+    def replace_rendered_template(self, remainder, params, output):
+        req = request._current_obj()
+        override_mapping = getattr(req, '_override_mapping', None)
+        if override_mapping:
+            _replace_override_mapping(override_mapping, self.templates_replacements)
+
+        if self.dynamic_controllers:
+            decoration = Decoration.get_decoration(_dispatched_controller(req))
+            if getattr(decoration, '_pluggable_templates_replacements', None) is not self.templates_replacements:
+                _replace_decoration_templates(decoration, self.templates_replacements)
+
+
+def apply_templates_replacements(root, templates_replacements):
+    """Replaces the templates exposed by all the controllers reachable from ``root``.
+
+    Returns whether any of the controllers can dispatch to controllers
+    that are not its attributes, through ``_lookup`` or ``_default``.
+    """
+    visited = set()
+    dynamic_controllers = False
+    controllers = [root]
+    while controllers:
+        controller = controllers.pop()
+        if id(controller) in visited:
+            continue
+        visited.add(id(controller))
+        dynamic_controllers = dynamic_controllers or hasattr(controller, '_lookup') or \
+            hasattr(controller, '_default')
+
+        for name, member in _members(controller):
+            if isinstance(member, DecoratedController):
+                controllers.append(member)
+                continue
+            elif isinstance(member, LazyController):
+                # Replaced when loaded, its dynamic controllers are not known yet
+                dynamic_controllers = True
+                continue
+
+            decoration = getattr(member, 'decoration', None)
+            if isinstance(decoration, Decoration):
+                _replace_decoration_templates(decoration, templates_replacements)
+    return dynamic_controllers
+
+
+def _members(controller):
+    # Like inspect.getmembers, but skipping attributes that fail outside of a request
+    for name in dir(controller):
+        try:
+            yield name, getattr(controller, name)
+        except Exception:
+            continue
+
+
+def _replace_decoration_templates(decoration, templates_replacements):
+    if getattr(decoration, '_pluggable_templates_replacements', None) is templates_replacements:
+        return
+
+    engines = getattr(decoration, '_pluggable_original_engines', None)
+    custom_engines = getattr(decoration, '_pluggable_original_custom_engines', None)
+    if engines is None:
+        if not any(engine[1] in templates_replacements for engine in decoration.engines.values()) and \
+                not any(engine[2] in templates_replacements for engine in decoration.custom_engines.values()):
+            decoration._pluggable_templates_replacements = templates_replacements
+            return
+        engines = decoration._pluggable_original_engines = dict(decoration.engines)
+        custom_engines = decoration._pluggable_original_custom_engines = dict(decoration.custom_engines)
 
+    for content_type, (engine, template, exclude_names, render_params) in engines.items():
+        engine, template = _replaced(templates_replacements, engine, template)
+        decoration.engines[content_type] = (engine, template, exclude_names, render_params)
+
+    for custom_format, (content_type, engine, template, exclude_names, render_params) in custom_engines.items():
+        engine, template = _replaced(templates_replacements, engine, template)
+        decoration.custom_engines[custom_format] = (content_type, engine, template, exclude_names, render_params)
+    decoration._pluggable_templates_replacements = templates_replacements
+
+
+def _replaced(templates_replacements, engine, template):
+    replaced_template = templates_replacements.get(template)
+    if replaced_template:
+        engine, template = replaced_template.split(':', 1)
+    return engine, template
+
+
+def _replace_override_mapping(override_mapping, templates_replacements):
+    for engines in override_mapping.values():
+        for content_type, engine in list(engines.items()):
+            replaced_template = templates_replacements.get(engine[1])
+            if replaced_template:
+                engines[content_type] = replaced_template.split(':', 1) + list(engine[2:])
+
+
+def _dispatched_controller(req):
     try:
         dispatch_state = req._dispatch_state
     except:
@@ -47,22 +171,15 @@ def _replace_template_hook(remainder, params, output):
 
     try:
         if req.validation.exception:
-            controller = req.validation.error_handler
-        else:
-            controller = dispatch_state.method
+            return req.validation.error_handler
     except (AttributeError, KeyError):
-        controller = dispatch_state.method
-
-    decoration = Decoration.get_decoration(controller)
+        pass
 
-    if 'tg.locals' in req.environ:
-        content_type, engine, template, exclude_names = decoration.lookup_template_engine(req.environ['tg.locals'])[:4]
-    else:
-        content_type, engine, template, exclude_names = decoration.lookup_template_engine(req)[:4]
+    try:
+        return dispatch_state.action
+    except AttributeError:  # TG < 2.4
+        return dispatch_state.method
 
-    replaced_template = tg.config['_pluggable_templates_replacements'].get(template)
-    if replaced_template:
-        override_template(decoration.controller, replaced_template)
 
 def _init_replacements(app_config, conf=None):
     if conf is None:
@@ -78,7 +195,10 @@ def _init_replacements(app_config, conf=None):
             engine = conf.get('default_renderer')
         templates_replacements[replaced_template] = '%s:%s' % (engine, template)
 
+    applier = _TemplateReplacementsApplier(templates_replacements)
     try:  # TG2.3
-        app_config.register_hook('before_render', _replace_template_hook)
+        app_config.register_hook('after_config', applier.apply)
+        app_config.register_hook('before_render', applier.replace_rendered_template)
     except AttributeError:  # TG2.4+
-        tg.hooks.register('before_render', _replace_template_hook)
+        tg.hooks.register('configure_new_app', applier.new_app_created)
+        tg.hooks.register('before_render', applier.replace_rendered_template)
@@ -1,8 +1,106 @@
-import sys, tg
+import os, sys, copy, inspect, threading, time
+import tg
+import tg.request_local
 from tg.decorators import Decoration
 from tg.render import render as tg_render
 from tg.exceptions import HTTPFound
+from tg.i18n import get_lang
+
+try:
+    import transaction
+except ImportError:
+    transaction = None
+
 from .detect import detect_model
+from .caching import partial_cache_options, partial_cache_key, partials_cache, dependencies_tags
+
+
+class PartialRecord(object):
+    """Everything required to call and render a partial.
+
+    The partial callable is resolved when the record is created, while the
+    template and render options are computed by :meth:`prepare` as they
+    are only available once the application renderers have been set up.
+    Partials exposed by a controller class are recorded with their ``owner``
+    class, which is only instantiated the first time the partial is called.
+    """
+    __slots__ = ('path', 'func', 'owner', 'bound', 'cache_options', 'cache_tags',
+                 'engine', 'template', 'render_params')
+
+    _owner_lock = threading.Lock()
+
+    def __init__(self, path, func, owner=None):
+        self.path = path
+        self.func = func
+        self.owner = owner
+        self.bound = func if owner is None else None
+        self.cache_options = partial_cache_options(func)
+        self.cache_tags = frozenset()
+        self.engine = None
+        self.template = None
+        self.render_params = {}
+
+    def resolve(self):
+        """The callable of the partial, bound to an instance of its owner class."""
+        bound = self.bound
+        if bound is None:
+            with self._owner_lock:
+                if self.bound is None:
+                    self.bound = getattr(self.owner(), self.func.__name__)
+                bound = self.bound
+        return bound
+
+    def prepare(self, config):
+        if self.cache_options is not None:
+            # Models tables might have been renamed while plugging
+            self.cache_tags = dependencies_tags(self.cache_options['depends_on'])
+
+        # Expect partials not to expose more than one template
+        available_engines = list(Decoration.get_decoration(self.func).engines.values())
+        if not available_engines:
+            self.engine, self.template, self.render_params = None, None, {}
+            return self
+
+        engine_name, template_name, exclude_names = available_engines[0][:3]
+        replaced_template = config.get('_pluggable_templates_replacements', {}).get(template_name)
+        if replaced_template:
+            engine_name, template_name = replaced_template.split(':', 1)
+
+        # Avoid placing the doctype declaration in Genshi and Kajiki templates
+        render_params = {}
+        if engine_name == 'genshi':
+            render_params['doctype'] = None
+        if engine_name == 'kajiki':
+            render_params['is_fragment'] = True
+
+        self._check_template(config, engine_name, template_name)
+        self.engine, self.template, self.render_params = engine_name, template_name, render_params
+        return self
+
+    def _check_template(self, config, engine_name, template_name):
+        render_functions = config.get('render_functions')
+        if render_functions is None or not template_name:
+            # Nothing to check for partials without templates or TG2.3 renderers
+            return
+
+        renderer = render_functions.get(engine_name)
+        if renderer is None:
+            raise ValueError('Partial %s renders %s with the %s renderer, which is not enabled' % (
+                self.path, template_name, engine_name))
+
+        loader = getattr(renderer, 'loader', None)
+        finder = getattr(loader, 'dotted_finder', None)
+        extension = getattr(loader, 'template_extension', None)
+        if finder is None or extension is None or template_name.endswith(extension):
+            return
+
+        try:
+            filename = finder.get_dotted_filename(template_name=template_name,
+                                                  template_extension=extension)
+        except ImportError:
+            filename = None
+        if filename is None or (filename != template_name and not os.path.exists(filename)):
+            raise ValueError('Template %s of partial %s not found' % (template_name, self.path))
 
 
 class PartialCaller(object):
@@ -31,39 +129,177 @@ class PartialCaller(object):
         func = getattr(controller, func)
         return func
 
+    def discover(self, module):
+        """Records for all the partials exposed by a partials module.
+
+        Partials are the exposed functions of the module and the exposed
+        methods of the classes declared in the module. Returns a dictionary
+        of partial paths and :class:`PartialRecord` instances that are
+        still to be prepared.
+        """
+        records = {}
+        for name, value in list(vars(module).items()):
+            if name.startswith('_') or getattr(value, '__module__', None) != module.__name__:
+                continue
+
+            if inspect.isclass(value):
+                methods = [attr for attr, member in vars(value).items()
+                           if not attr.startswith('_') and hasattr(member, 'decoration')]
+                for method in methods:
+                    path = '%s.%s:%s' % (module.__name__, name, method)
+                    records[path] = PartialRecord(path, getattr(value, method), owner=value)
+            elif hasattr(value, 'decoration'):
+                path = '%s:%s' % (module.__name__, name)
+                records[path] = PartialRecord(path, value)
+
+        return records
+
     def __call__(self, path, **params):
         config = tg.config._current_obj()
-        try:
-            func = config['tgext.pluggable.partials_cache'][path]
-        except:
-            func = config['tgext.pluggable.partials_cache'][path] = self.resolve(path)
-
-        result = func(**params)
+        record = config['tgext.pluggable.partials_cache'].get(path)
+        if record is None:
+            record = PartialRecord(path, self.resolve(path)).prepare(config)
+            config['tgext.pluggable.partials_cache'][path] = record
+
+        cache_options = record.cache_options
+        if cache_options is not None:
+            cache_key = partial_cache_key(path, params, get_lang() or ())
+            if cache_key is not None:
+                cache = partials_cache(config)
+                output = cache.get(path, cache_key)
+                if output is None:
+                    output = self.render(record, params)
+                    cache.set(cache_key, output, cache_options['expire'], record.cache_tags)
+                return output
+
+        return self.render(record, params)
+
+    def render(self, record, params):
+        result = record.resolve()(**params)
 
         if not isinstance(result, dict):
             return result
 
-        # Expect partials not to expose more than one template
-        available_engines = list(Decoration.get_decoration(func).engines.values())
-        engine_name, template_name, exclude_names = available_engines[0][:3]
-        replaced_template = config.get('_pluggable_templates_replacements', {}).get(template_name)
-        if replaced_template:
-            engine_name, template_name = replaced_template.split(':', 1)
-
-        # Avoid placing the doctype declaration in Genshi and Kajiki templates
-        render_params = {}
-        if engine_name == 'genshi':
-            render_params['doctype'] = None
-        if engine_name == 'kajiki':
-            render_params['is_fragment'] = True
+        if record.engine is None:
+            raise ValueError('Partial %s returned a dictionary but exposes no template' % record.func)
 
-        return tg_render(template_vars=result, template_engine=engine_name,
-                         template_name=template_name, **render_params)
+        return tg_render(template_vars=result, template_engine=record.engine,
+                         template_name=record.template, **record.render_params)
 
 
 call_partial = PartialCaller()
 
 
+class BatchPartialCaller(object):
+    """Renders multiple partials concurrently.
+
+    Partials are rendered by a pool of ``tgext.pluggable.partials_workers``
+    threads (4 by default) shared by all the requests. Each partial runs with
+    the configuration of the calling thread and a copy of its request context,
+    with its own template context, so they should not modify the request or
+    response and must not write to the database as any change they perform
+    is discarded at the end of the partial.
+
+    Batches started by a partial that is already running in the pool are
+    rendered sequentially in the same thread, as waiting for the pool from
+    inside the pool could deadlock it. Unless a ``timeout`` is provided, the
+    whole batch must complete within ``tgext.pluggable.partials_timeout``
+    seconds (30 by default) or a ``TimeoutError`` is raised.
+    When the batch fails the partials that didn't start yet are cancelled,
+    while the running ones lose access to the request, response and template
+    context of the finished request and their output is discarded.
+    """
+    DETACHED_CONTEXT_MEMBERS = ('request', 'response', 'tmpl_context', 'session', 'cache')
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._worker = threading.local()
+
+    def executor(self, config):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    workers = int(config.get('tgext.pluggable.partials_workers', 4))
+                    self._executor = ThreadPoolExecutor(max_workers=workers)
+        return self._executor
+
+    def __call__(self, partials, timeout=None):
+        """Renders ``partials`` and returns their output in the same order.
+
+        Each partial can be specified as a path or as a ``(path, params)`` tuple::
+
+            call_partials(['plugname.partials:menu',
+                           ('plugname.partials:something', dict(name='Partial'))])
+        """
+        calls = []
+        for partial in partials:
+            if isinstance(partial, tuple):
+                path, params = partial
+            else:
+                path, params = partial, {}
+            calls.append((path, params or {}))
+
+        if len(calls) < 2 or getattr(self._worker, 'active', False):
+            return [call_partial(path, **params) for path, params in calls]
+
+        config = tg.config._current_obj()
+        if timeout is None:
+            timeout = float(config.get('tgext.pluggable.partials_timeout', self.DEFAULT_TIMEOUT))
+        context = tg.request_local.context._current_obj()
+        executor = self.executor(config)
+
+        deadline = time.time() + timeout
+        contexts = [self._copy_context(context) for _ in calls]
+        futures = [executor.submit(self._render, config, worker_context, path, params)
+                   for worker_context, (path, params) in zip(contexts, calls)]
+        try:
+            return [future.result(max(deadline - time.time(), 0)) for future in futures]
+        except Exception:
+            for future, worker_context in zip(futures, contexts):
+                if not future.cancel():
+                    self._detach_context(worker_context)
+            raise
+
+    def _copy_context(self, context):
+        worker_context = copy.copy(context)
+        tmpl_context = getattr(context, 'tmpl_context', None)
+        if tmpl_context is not None:
+            worker_context.tmpl_context = copy.copy(tmpl_context)
+        return worker_context
+
+    def _detach_context(self, worker_context):
+        """Prevents partials still running from touching the finished request"""
+        for name in self.DETACHED_CONTEXT_MEMBERS:
+            try:
+                delattr(worker_context, name)
+            except AttributeError:
+                pass
+
+    def _render(self, config, context, path, params):
+        self._worker.active = True
+        tg.config.push_thread_config(config)
+        tg.request_local.context._push_object(context)
+        try:
+            return call_partial(path, **params)
+        finally:
+            self._worker.active = False
+            if transaction is not None:
+                transaction.abort()
+
+            DBSession = config.get('DBSession')
+            if hasattr(DBSession, 'remove'):
+                DBSession.remove()
+
+            tg.request_local.context._pop_object(context)
+            tg.config.pop_thread_config(config)
+
+
+call_partials = BatchPartialCaller()
+
+
 def mount_point(pluggable_name):
     pluggable_info = tg.config['tgext.pluggable.plugged']['modules'][pluggable_name]
     pluggable_path = pluggable_info['appid'].replace('.', '/')
@@ -101,6 +337,31 @@ def plug_url(pluggable_name, path, params=None, lazy=False, qualified=False):
                       **conditional_options)
 
 
+def plug_static_url(pluggable_name, path, qualified=False):
+    """Url of a static file provided by a pluggable.
+
+    When the pluggable was plugged with ``statics_manifest=True`` and the
+    file is listed in the manifest the url includes a fingerprint of the
+    file content, so that it can be cached forever by browsers.
+    """
+    if not path.startswith('/'):
+        path = '/' + path
+
+    params = {}
+    pluggable_info = tg.config['tgext.pluggable.plugged']['modules'][pluggable_name]
+    manifest = pluggable_info.get('statics_manifest')
+    if manifest is not None:
+        file_info = manifest.get(path)
+        if file_info is not None:
+            params['v'] = file_info.fingerprint
+
+    conditional_options = {}
+    if qualified is not False:
+        conditional_options['qualified'] = qualified
+
+    return tg.url('/_pluggable/' + pluggable_name + path, params=params, **conditional_options)
+
+
 def plug_redirect(pluggable_name, path, params=None):
     url = plug_url(pluggable_name, path, params)
     raise HTTPFound(location=url)